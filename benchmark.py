@@ -0,0 +1,284 @@
+"""
+benchmark.py
+Benchmark suite of the time evolution. Every combination of dimension,
+grid size, time step, boundary condition and method is timed with warmup
+and repeats, and its memory use (the peak resident memory, every case
+running in a new process), norm drift and distance to the exact
+Crank-Nicholson solution are measured. The results are printed and
+written to a JSON file, to compare between versions of the code.
+
+Usage:
+    python benchmark.py --dims 1 2 --points 128 256 --output bench.json
+    python benchmark.py --dims 2 --points 512 --dtype complex128 complex64
+
+Methods:
+    CN: default engine, the CN matrix is factorised once.
+    matrixFree: CN with B psi from the stencil Hamiltonian.
+    spsolve: CN with a direct sparse solve every step.
+    cgs, bicgstab, gmres, lgmres, qmr: CN with scipy iterative solvers,
+        started from the previous psi.
+    CN4, CN6: CN engine with the order 4 and 6 Pade propagators.
+    bicgstabILU, cgsILU, gmresILU, lgmresILU, qmrILU: CN with the Krylov
+        backends of solvers.py, ILU preconditioned and warm started.
+    ADI, FFT, Krylov: the engines of propagators.py (ADI in 2D and 3D,
+        FFT only without boundaries).
+    ParallelADI: ADI decomposed over all the cores, see
+        decomposition.py (2D).
+
+Replaces compare_times.py.
+Created on: 18-10-2026.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import resource
+import time
+import numpy as np
+import scipy
+import scipy.sparse.linalg as sla
+import simulation as sm
+import solvers
+
+ITERATIVE = ["cgs", "bicgstab", "gmres", "lgmres", "qmr"]
+BACKENDS = [method + "ILU" for method in solvers.KrylovSolver.methods]
+METHODS = ["CN", "CN4", "CN6", "matrixFree", "spsolve"] + ITERATIVE + \
+    BACKENDS + ["ADI", "FFT", "Krylov", "ParallelADI"]
+
+domainLength = 15
+startPoint = 0
+
+
+def potentialWell(*x):
+    """Square barrier 6 < x < 10 of height 500, along the first axis."""
+    return np.where((x[0] > 6) & (x[0] < 10), 500., 0.)
+
+
+def supported(method, dim, dirichletBC):
+    """Whether the method can run the given system."""
+    if method == "ADI":
+        return dim > 1
+    if method == "ParallelADI":
+        return dim == 2
+    if method == "FFT":
+        return not dirichletBC
+    return True
+
+
+def makeSimulation(method, dim, numberPoints, dt, dirichletBC,
+                   dtype="complex128", tol=1e-8):
+    """Simulation with a pulse heading to the barrier."""
+    engine = method if method in ("ADI", "FFT", "Krylov") else "CN"
+    order = int(method[2]) if method in ("CN4", "CN6") else 2
+    solver = "auto"
+    options = None
+    if method in BACKENDS:
+        solver = method[:-len("ILU")]
+        options = {"tol": tol, "preconditioner": "ilu"}
+    workers = None
+    if method == "ParallelADI":
+        engine = "ADI"
+        workers = os.cpu_count()
+    sim = sm.Simulation(dim, potentialWell, dirichletBC, numberPoints,
+                        [startPoint]*dim if dim > 1 else startPoint,
+                        domainLength, dt, engine=engine, order=order,
+                        matrixFree=(method == "matrixFree"),
+                        solver=solver, solverOptions=options,
+                        workers=workers,
+                        dtype=np.dtype(dtype))
+    if dim == 1:
+        sim.setPsiPulse(pulse="plane", energy=500, center=2)
+    else:
+        sim.setPsiPulse(pulse="circular", energy=500, center=[2]*dim,
+                        vel=[1] + [0]*(dim - 1), width=.5)
+    return sim
+
+
+def stepFunction(sim, method, tol):
+    """Function that evolves sim one step with the method."""
+    if method not in ITERATIVE + ["spsolve"]:
+        return sim.evolve
+
+    if method == "spsolve":
+        def step():
+            sim.psi = sla.spsolve(sim.A, sim.B.dot(sim.psi))
+            sim.time += sim.dt
+        return step
+
+    solver = getattr(sla, method)
+
+    def step():
+        sim.psi = solver(sim.A, sim.B.dot(sim.psi), x0=sim.psi, rtol=tol,
+                         atol=0)[0]
+        sim.time += sim.dt
+    return step
+
+
+def runCase(method, dim, numberPoints, dt, dirichletBC, steps=20,
+            repeats=5, warmup=2, tol=1e-8, dtype="complex128"):
+    """
+    Benchmark one method on one system.
+    Inputs:
+        method: (str) One of METHODS.
+        dim, numberPoints, dt, dirichletBC: The system, as in Simulation.
+        steps: (int) Steps per timed repeat.
+        repeats: (int) Number of timed repeats.
+        warmup: (int) Untimed steps before the repeats.
+        tol: (float) Relative tolerance of the iterative solvers.
+        dtype: (str) Precision of psi, "complex128" or "complex64".
+    Output:
+        (dict) Timings in seconds per step, memory in bytes and accuracy.
+        The memory is the growth of the peak resident memory of the
+        process, so it is only right in a fresh process, see
+        isolatedCase.
+    """
+    # Memory of the setup and the first step, including what C libraries
+    # allocate, like the SuperLU factors
+    baseline = peakResidentMemory()
+    start = time.perf_counter()
+    sim = makeSimulation(method, dim, numberPoints, dt, dirichletBC,
+                         dtype, tol)
+    step = stepFunction(sim, method, tol)
+    setup = time.perf_counter() - start
+    step()
+    peakMemory = peakResidentMemory() - baseline
+
+    for i in range(warmup):
+        step()
+    times = []
+    for r in range(repeats):
+        start = time.perf_counter()
+        for i in range(steps):
+            step()
+        times.append((time.perf_counter() - start)/steps)
+    totalSteps = 1 + warmup + repeats*steps
+
+    # Exact CN solution of the same run, in double precision
+    if method == "CN" and dtype == "complex128":
+        error = 0.
+    else:
+        reference = makeSimulation("CN", dim, numberPoints, dt, dirichletBC)
+        for i in range(totalSteps):
+            reference.evolve()
+        error = float(np.abs(reference.psi - sim.psi).max())
+
+    times = np.array(times)
+    return {"method": method, "dim": dim, "numberPoints": numberPoints,
+            "dt": dt, "dirichletBC": dirichletBC, "dtype": dtype,
+            "gridSize": sim.psi.size,
+            "steps": totalSteps, "setup": setup,
+            "median": float(np.median(times)),
+            "p10": float(np.percentile(times, 10)),
+            "p90": float(np.percentile(times, 90)),
+            "min": float(times.min()), "peakMemory": peakMemory,
+            "normDrift": sim.normDrift(),
+            "errorVsCN": error}
+
+
+def peakResidentMemory():
+    """Peak resident memory of this process in bytes (Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def isolatedCase(*args, **options):
+    """
+    runCase in a new process, so that its memory is not hidden by the
+    peak of the previous cases. The workers of ParallelADI are not
+    counted.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(runCase, args, options)
+
+
+def environment():
+    """Versions and machine of the run, to tell results apart."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "machine": platform.platform(),
+            "processor": platform.processor(), "commit": commit,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def runSuite(dims=(1, 2), points=(128, 256), dts=(.001,),
+             boundaries=(False, True), methods=METHODS,
+             dtypes=("complex128",), output=None, **options):
+    """
+    Benchmark every supported combination of the given parameters.
+    Inputs:
+        dims, points, dts, boundaries, methods, dtypes: (lists) Values
+            to sweep.
+        output: (str) JSON file for the results, if any.
+        options: Passed to runCase (steps, repeats, warmup, tol).
+    Output:
+        (dict) The environment and the list of results.
+    """
+    results = []
+    for dim in dims:
+        for numberPoints in points:
+            for dt in dts:
+                for dirichletBC in boundaries:
+                    for method in methods:
+                        if not supported(method, dim, dirichletBC):
+                            continue
+                        for dtype in dtypes:
+                            result = isolatedCase(method, dim,
+                                                  numberPoints, dt,
+                                                  dirichletBC, dtype=dtype,
+                                                  **options)
+                            printResult(result)
+                            results.append(result)
+
+    report = {"environment": environment(), "options": options,
+              "results": results}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+def printResult(r):
+    print("%dD N=%-4d dt=%-6g %-9s %-11s %-10s %9.3f ms [%7.3f, %7.3f] "
+          "mem %7.1f MB drift %.1e err %.1e" %
+          (r["dim"], r["numberPoints"], r["dt"],
+           "dirichlet" if r["dirichletBC"] else "free", r["method"],
+           r["dtype"],
+           1e3*r["median"], 1e3*r["p10"], 1e3*r["p90"],
+           r["peakMemory"]/2**20, r["normDrift"], r["errorVsCN"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--dims", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--points", type=int, nargs="+", default=[128, 256])
+    parser.add_argument("--dt", type=float, nargs="+", default=[.001])
+    parser.add_argument("--bc", choices=["free", "dirichlet"], nargs="+",
+                        default=["free", "dirichlet"])
+    parser.add_argument("--methods", nargs="+", choices=METHODS,
+                        default=METHODS)
+    parser.add_argument("--dtype", choices=["complex128", "complex64"],
+                        nargs="+", default=["complex128"])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--tol", type=float, default=1e-8)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    runSuite(dims=args.dims, points=args.points, dts=args.dt,
+             boundaries=[bc == "dirichlet" for bc in args.bc],
+             methods=args.methods, dtypes=args.dtype, output=args.output,
+             steps=args.steps,
+             repeats=args.repeats, warmup=args.warmup, tol=args.tol)
+
+
+if __name__ == "__main__":
+    main()
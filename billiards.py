@@ -24,11 +24,8 @@ domainLength = 1
 def lorentzGas(x, y):
     '''Potential corresponding to the Lorentz Gas billiard'''
     center = [0.5, 0.5]
-    r = np.linalg.norm([x - center[0], y - center[1]])
-    if r < .2:
-        return 20000
-    else:
-        return 0
+    r = np.hypot(x - center[0], y - center[1])
+    return np.where(r < .2, 20000, 0)
 
 
 # Create the simulation for the system
@@ -0,0 +1,300 @@
+"""
+decomposition.py
+Domain decomposition of the ADI engine over the cores of one machine, for
+2D grids too large for a single process.
+
+psi, the state between the two sweeps of a step and the potential are
+kept in shared memory. The grid is split into strips, one per process:
+in the sweep implicit along x every process solves the lines of its strip
+of y columns, in the sweep implicit along y those of its strip of x rows.
+The explicit half of a sweep also needs the line on each side of the
+strip (the halo), which is read from the shared array written by the
+neighbours in the previous sweep, and barriers keep the sweeps apart. The
+tridiagonal systems of a strip are factorised by its process, so no
+process holds the factorisation of the whole grid.
+
+The lines are independent, so the result is that of propagators.ADI up
+to rounding.
+
+Usage:
+    sim = Simulation(2, potential, True, 2048, [0, 0], 15, 1e-4,
+                     engine="ADI", workers=8)
+
+Created on: 18-10-2026.
+"""
+import ctypes
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+import weakref
+import numpy as np
+import matrix
+import propagators
+
+# Commands of the worker processes
+STEP, FACTORISE, STOP = range(3)
+
+
+class WorkerError(RuntimeError):
+    """A worker process of the parallel ADI failed or died."""
+
+
+class ParallelADI(propagators.ADI):
+    """
+    Peaceman-Rachford ADI evolution of a 2D system (see propagators.ADI)
+    with the lines of every sweep split among worker processes. The
+    calling process solves the first strip, and workers - 1 processes
+    forked on the first step solve the others.
+    """
+
+    def __init__(self, potential, dirichletBC, numberPoints, domainLength,
+                 dt, workers=None):
+        """
+        Inputs:
+            potential, dirichletBC, numberPoints, domainLength, dt: As in
+                propagators.ADI, potential being 2D.
+            workers: (int) Number of processes, by default the number of
+                cores.
+        """
+        if potential.ndim != 2:
+            raise ValueError("The parallel ADI engine needs dim = 2.")
+        self.workers = workers or os.cpu_count()
+        self._processes = []
+        self._buffers = None
+        self._potential = None
+        super().__init__(potential, dirichletBC, numberPoints, domainLength,
+                         dt)
+
+    def _factorise(self):
+        """Share the potential and factorise the systems of the strips."""
+        n = self.sharedV.shape[0]
+        if self.workers > n:
+            raise ValueError("More workers than lines of the grid.")
+        bounds = np.linspace(0, n, self.workers + 1).round().astype(int)
+        self.strips = list(zip(bounds[:-1], bounds[1:]))
+
+        if self._potential is None:
+            self._potential = _sharedArray(self.sharedV.shape,
+                                           self.sharedV.dtype)
+        self._potential[...] = self.sharedV
+        self.sharedV = self._potential
+        if self._processes:
+            self._command(FACTORISE)
+        self.solvers = self._stripSolvers(self.strips[0])
+        if self._processes:
+            self._wait()
+
+    def _stripSolvers(self, strip):
+        """Factorisations of the lines of a strip, for every sweep."""
+        lines = slice(*strip)
+        return {(axis, a): self._lineSolver(axis, a, lines)
+                for axis, a, explicit in self.sweeps}
+
+    def _sweepStrip(self, source, target, axis, a, strip, solver):
+        """
+        One sweep on the lines of a strip: solve (1 + i a H_axis) x =
+        (1 - i a H_other) source there, and write x to target.
+        """
+        axis = axis % 2
+        other = 1 - axis
+        start, stop = strip
+        # The strip and its halo
+        low, high = max(start - 1, 0), min(stop + 1, source.shape[other])
+        index = [slice(None)]*2
+        index[other] = slice(low, high)
+        u = source[tuple(index)]
+        v = self.sharedV[tuple(index)]
+        rhs = u - 1j*a*(matrix.secondDifference(u, other, self.h) + v*u)
+
+        index[other] = slice(start - low, stop - low)
+        # One line after the other, as in the factorisation
+        rhs = np.moveaxis(rhs[tuple(index)], axis, -1)
+        x = solver.solve(np.ascontiguousarray(rhs).reshape(-1, 1))
+        index[other] = slice(start, stop)
+        target[tuple(index)] = np.moveaxis(x.reshape(rhs.shape), -1, axis)
+
+    def _sweeps(self, strip, solvers):
+        """Both sweeps of a step on a strip, waiting for the others."""
+        for k, (axis, a, explicit) in enumerate(self.sweeps):
+            self._sweepStrip(self._buffers[k % 2], self._buffers[1 - k % 2],
+                             axis, a, strip, solvers[axis, a])
+            self._wait()
+
+    def _start(self, dtype):
+        """Allocate the shared states and fork the workers."""
+        if self._buffers is not None and self._buffers[0].dtype == dtype:
+            return
+        self.close()
+        self._buffers = [_sharedArray(self.sharedV.shape, dtype)
+                         for i in range(2)]
+        if self.workers == 1:
+            return
+        context = multiprocessing.get_context("fork")
+        self._owner = os.getpid()
+        self._barrier = _Barrier(context, self.workers)
+        self._commandValue = context.RawValue(ctypes.c_int, STEP)
+        self._processes = [context.Process(target=_worker, args=(self, k),
+                                           daemon=True)
+                           for k in range(1, self.workers)]
+        for process in self._processes:
+            process.start()
+        # A worker killed by a signal (e.g. out of memory) never reaches
+        # the barrier, the watchdog then breaks it
+        threading.Thread(target=_watch, args=(self._barrier,
+                                              self._processes),
+                         daemon=True).start()
+        self._finalizer = weakref.finalize(self, _stop, self._barrier,
+                                           self._commandValue,
+                                           self._processes)
+
+    def _command(self, command):
+        """Start a command in the workers."""
+        self._commandValue.value = command
+        self._wait()
+
+    def _wait(self):
+        """Wait for the workers at the barrier."""
+        if not self._processes:
+            return
+        try:
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            if os.getpid() == self._owner:
+                self.close()
+            raise WorkerError("A worker of the parallel ADI failed.")
+
+    def step(self, psi):
+        """Return psi, of shape (grid,) or (K, grid), evolved one step."""
+        if psi.ndim > 1:
+            return np.array([self.step(p) for p in psi])
+        psi = psi.reshape(self.shape)
+        self._start(np.result_type(psi, self.sharedV, np.complex64))
+        self._buffers[0][...] = psi[self.active]
+        if self._processes:
+            self._command(STEP)
+        self._sweeps(self.strips[0], self.solvers)
+
+        u = self._buffers[0].copy()
+        if self.edgeFactor is not None:
+            new = self.edgeFactor*psi
+            new[self.active] = u
+            u = new
+        return u.reshape(-1)
+
+    def close(self):
+        """
+        Stop the worker processes. The next step forks new ones.
+        """
+        if self._processes:
+            self._finalizer()
+            self._processes = []
+        self._buffers = None
+
+
+class _Barrier:
+    """
+    Barrier of the processes of a ParallelADI, like threading.Barrier. In
+    multiprocessing.Barrier a process killed while it waits blocks the
+    others forever, as waking up the waiting processes waits for each of
+    them. Here abort() only sets a flag, which the waiting processes check
+    while they wait, so they raise BrokenBarrierError.
+    """
+
+    def __init__(self, context, parties):
+        self.parties = parties
+        self._lock = context.Lock()
+        self._count = context.RawValue(ctypes.c_int, 0)
+        self._generation = context.RawValue(ctypes.c_int, 0)
+        self._broken = context.RawValue(ctypes.c_bool, False)
+        # Consecutive waits use different semaphores, so a process that
+        # is already at the next wait cannot take a release of this one
+        self._release = [context.Semaphore(0), context.Semaphore(0)]
+
+    def _acquire(self, lock, deadline):
+        """Acquire a lock or semaphore, unless the barrier breaks."""
+        while not lock.acquire(timeout=.1):
+            if self._broken.value or (deadline is not None and
+                                      time.monotonic() > deadline):
+                self.abort()
+                raise threading.BrokenBarrierError
+
+    def wait(self, timeout=None):
+        """Wait until all the parties wait, breaking after timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._acquire(self._lock, deadline)
+        try:
+            if self._broken.value:
+                raise threading.BrokenBarrierError
+            release = self._release[self._generation.value % 2]
+            self._count.value += 1
+            if self._count.value == self.parties:
+                self._count.value = 0
+                self._generation.value += 1
+                for i in range(self.parties - 1):
+                    release.release()
+                return
+        finally:
+            self._lock.release()
+        self._acquire(release, deadline)
+
+    def abort(self):
+        """Break the barrier, the waiting processes raise."""
+        self._broken.value = True
+
+
+def _sharedArray(shape, dtype):
+    """Array in memory shared with the processes forked afterwards."""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))*dtype.itemsize
+    buffer = multiprocessing.get_context("fork").RawArray(ctypes.c_char,
+                                                          size)
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _worker(adi, k):
+    """Worker process: run the commands on strip k until STOP."""
+    strip = adi.strips[k]
+    try:
+        solvers = adi._stripSolvers(strip)
+        while True:
+            adi._barrier.wait()
+            command = adi._commandValue.value
+            if command == STOP:
+                return
+            if command == FACTORISE:
+                solvers = adi._stripSolvers(strip)
+                adi._barrier.wait()
+            else:
+                adi._sweeps(strip, solvers)
+    except (threading.BrokenBarrierError, WorkerError):
+        # Another process failed
+        return
+    except BaseException:
+        # Wakes up the other processes, which then stop
+        adi._barrier.abort()
+        raise
+
+
+def _watch(barrier, processes):
+    """
+    Thread of the main process: break the barrier when a worker exits,
+    so that no process waits forever for a dead one. The workers only
+    exit after STOP, when the barrier is no longer used.
+    """
+    multiprocessing.connection.wait([p.sentinel for p in processes])
+    barrier.abort()
+
+
+def _stop(barrier, command, processes):
+    """Stop the workers, also called when the propagator is collected."""
+    command.value = STOP
+    try:
+        barrier.wait(timeout=10)
+    except threading.BrokenBarrierError:
+        pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
@@ -28,12 +28,10 @@ def doubleSlit(x, y):
     spY = 1   # Y coordinate of center of slits
     bW = 0.03  # Barrier width
     mag = 20000   # Barrier potential
-    if x > spX and x < spX+bW and (y < spY-sS/2. or y > spY+sS/2.):
-        return mag
-    if x > spX and x < spX+bW and (y > spY-sS/2.+sW and y < spY+sS/2.-sW):
-        return mag
-    else:
-        return 0
+    barrier = (x > spX) & (x < spX+bW)
+    outside = (y < spY-sS/2.) | (y > spY+sS/2.)
+    between = (y > spY-sS/2.+sW) & (y < spY+sS/2.-sW)
+    return np.where(barrier & (outside | between), mag, 0)
 
 
 # Create the simulation for the system
@@ -1,7 +1,9 @@
 """
 matrix.py
-Definition of the matrices that discretize the Hamiltonians in 1 and
-2 dimensions.
+Definition of the matrices that discretize the Hamiltonians in 1, 2 and
+3 dimensions. The matrices have the precision of the potential: a
+potential given as a float32 (complex64) array gives a float32 (complex64)
+matrix.
 
 Created on: 19-04-2017.
 @author: eduardo
@@ -9,159 +11,651 @@ Created on: 19-04-2017.
 
 import numpy as np
 import scipy.sparse as sp
+import scipy.sparse.linalg as sla
 
+# Central finite difference coefficients of -d^2/dx^2 (times h^2), from the
+# centre outwards, for the 2nd, 4th and 6th order stencils
+STENCILS = {2: [2, -1],
+            4: [5/2, -4/3, 1/12],
+            6: [49/18, -3/2, 3/20, -1/90]}
 
-def A1D(numberPoints, potentialFunc, domainStart, domainLength):
+
+def evaluatePotential(potential, *coords):
+    """
+    Evaluate the potential on the points given by the coordinate arrays.
+
+    The potential can be given as:
+        - an array with its values on the points, which is used directly,
+        - a function working on whole coordinate arrays, which is called once,
+        - a function of scalar coordinates, which is vectorised as a slower
+          fallback when it does not work on arrays.
+    Input:
+        Potential (array or function)
+        Coordinates x, y, ... (numpy arrays, broadcastable together)
+    Output:
+        Values of the potential (numpy array, broadcast shape of coords)
+    """
+    shape = np.broadcast(*coords).shape
+    if not callable(potential):
+        v = np.asarray(potential)
+        if v.size == 1:
+            v = np.full(shape, v.item())
+        return _asFloat(v.reshape(shape))
+
+    try:
+        v = np.asarray(potential(*coords))
+        if v.shape == shape:
+            return _asFloat(v)
+    except (TypeError, ValueError):
+        # e.g. the truth value of an array is ambiguous
+        pass
+    return _asFloat(np.vectorize(potential)(*coords))
+
+
+def absorbingLayer(coords, domainStart, domainLength, width, strength,
+                   power=2):
+    """
+    Strength W of a complex absorbing potential V - iW, which damps the
+    waves that enter a layer of the given width along the edges of the
+    domain instead of reflecting them. It grows from 0 at the inner side of
+    the layer to strength at the edge as (d/width)^power, d being the depth
+    into the layer, and the layers of the different axes add up.
+    Inputs:
+        coords: (list of numpy arrays) Coordinates x, y, ... of the points.
+        domainStart: (list of float) Start of the domain along each axis.
+        domainLength: (float, or list of float) Length of the domain,
+            or its length along each axis.
+        width: (float) Width of the layer.
+        strength: (float) Largest value of W.
+        power: (int) Power of the profile.
+    Output:
+        W (numpy array, broadcast shape of coords)
+    """
+    W = np.zeros(np.broadcast(*coords).shape)
+    lengths = np.broadcast_to(domainLength, (len(coords),))
+    for x, start, length in zip(coords, domainStart, lengths):
+        depth = np.maximum(start + width - x, x - (start + length - width))
+        W += strength*(np.clip(depth, 0, None)/width)**power
+    return W
+
+
+def _asFloat(v):
+    """
+    Return v as a floating point (or complex) array, keeping the precision
+    of floating point arrays.
+    """
+    if v.dtype.kind in 'fc':
+        return v
+    return v.astype(float)
+
+
+def _precision(v):
+    """
+    Type of the matrix of a potential v, single precision (float32 or
+    complex64) if v is, double otherwise.
+    """
+    return np.result_type(v, np.float32)
+
+
+def _assemble(diagonals, offsets, format, dtype=None):
+    """
+    Build a sparse matrix from its diagonals (same convention as sp.diags)
+    in one vectorised pass, filling the compressed arrays directly instead
+    of converting from intermediate DIA/COO matrices. Zero entries are not
+    stored, except on the main diagonal.
+    Input:
+        Diagonals (list of numpy vectors)
+        Offsets of the diagonals (list of int)
+        Sparse format of the output (string)
+        Type of the entries, by default that of the diagonals (numpy dtype)
+    Output:
+        Matrix A (scipy sparse matrix)
+    """
+    if format == 'csc':
+        # The CSC arrays of A are the CSR arrays of its transpose
+        At = _assemble(diagonals, [-o for o in offsets], 'csr', dtype)
+        return sp.csc_matrix((At.data, At.indices, At.indptr),
+                             shape=At.shape)
+
+    M = len(diagonals[0]) + abs(offsets[0])
+    order = np.argsort(offsets)
+    offsets = np.asarray(offsets)[order]
+    if dtype is None:
+        dtype = np.result_type(*diagonals)
+    index = np.int32 if M*len(offsets) < 2**31 else np.int64
+
+    # Row i holds the entries A[i, i + offset]
+    data = np.zeros((M, len(offsets)), dtype=dtype)
+    for k, d in enumerate(diagonals[j] for j in order):
+        if offsets[k] >= 0:
+            data[:M-offsets[k], k] = d
+        else:
+            data[-offsets[k]:, k] = d
+    keep = data != 0
+    keep[:, offsets == 0] = True
+
+    indptr = np.zeros(M+1, dtype=index)
+    np.cumsum(keep.sum(axis=1), out=indptr[1:])
+    cols = np.arange(M, dtype=index)[:, None] + offsets.astype(index)
+    A = sp.csr_matrix((data[keep], cols[keep], indptr), shape=(M, M))
+    return A.asformat(format)
+
+
+def diagonalIndex(A):
+    """
+    Return the positions of the main diagonal entries of a CSR or CSC
+    matrix in A.data, so that the diagonal can be updated in place.
+    """
+    major = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    index = np.flatnonzero(A.indices == major)
+    if len(index) != min(A.shape):
+        raise ValueError("Not all the diagonal entries are stored.")
+    return index
+
+
+def _stencil(order):
+    """Coefficients of the stencil of the given order, see STENCILS."""
+    if order not in STENCILS:
+        raise ValueError("The stencil order must be 2, 4 or 6.")
+    return STENCILS[order]
+
+
+def A1D(numberPoints, potentialFunc, domainStart, domainLength,
+        format='csc', stencilOrder=2):
     """
     Hamiltonian discretization in 1d without boundaries.
 
-    Uses Explicit method.
+    Uses Explicit method. psi is taken as 0 outside of the domain, also by
+    the wider stencils of order 4 and 6.
     Input:
         Number of points to evaluate on (float)
-        Potential function (vectorised function)
+        Potential (function of arrays, or array of its values on the grid)
         Location where domain starts (float)
         Length of domain (float)
+        Sparse format of the output (string)
+        Order of the finite difference stencil, 2, 4 or 6 (int)
     Output:
         Matrix A (scipy sparse matrix)
     """
     h = domainLength/numberPoints   # dx
 
     x = np.linspace(domainStart, domainStart + domainLength, numberPoints-1)
-    v = potentialFunc(x)
+    v = evaluatePotential(potentialFunc, x)
 
-    a = np.ones(numberPoints-1)*(2+(h**2 * v))
-    b = np.ones(numberPoints-2)*-1
-    A = sp.diags(a, 0) + sp.diags(b, 1) + sp.diags(b, -1)
+    c = _stencil(stencilOrder)
+    a = c[0]/h**2 + v
+    bands = [np.full(numberPoints-1-k, c[k]/h**2) for k in range(1, len(c))]
+    offsets = list(range(1, len(c)))
 
     # Periodic boundaries
     # A[0,-1] = -1
     # A[-1,0] = -1
 
-    return (1./h**2) * A
+    return _assemble(bands + [a] + bands, [-k for k in offsets] + [0] +
+                     offsets, format, _precision(v))
 
 
-def A1Dfull(numberPoints, potentialFunc, domainStart, domainLength):
+def A1Dfull(numberPoints, potentialFunc, domainStart, domainLength,
+            format='csc', stencilOrder=2):
     """
     Hamiltonian discretization in 1d with Dirichlet boundary conditions.
 
     Uses Explicit method to compute RHS of (A.68) in jos' book.
-    Here we take hbar = 2m = 1.
+    Here we take hbar = 2m = 1. The boundary points are decoupled, and the
+    stencils of order 4 and 6 take psi = 0 on and beyond them.
     Input:
         Number of points to evaluate on (float)
-        Potential function (vectorised function)
+        Potential (function of arrays, or array of its values on the grid)
         Location where domain starts (float)
         Length of domain (float)
+        Sparse format of the output (string)
+        Order of the finite difference stencil, 2, 4 or 6 (int)
     Output:
         Matrix A, the discretised Hamiltonian (scipy sparse matrix)
     """
     h = domainLength/numberPoints  # dx
 
     x = np.linspace(domainStart, domainStart + domainLength, numberPoints+1)
-    v = potentialFunc(x)
+    v = evaluatePotential(potentialFunc, x)
 
-    a = np.ones(numberPoints+1)*(2+(h**2 * v))
-    b = np.ones(numberPoints)*-1
+    a, offsets, bands = _laplacian(_interior(numberPoints+1, 1), h, 1,
+                                   stencilOrder)
+    # The boundary points are decoupled from the rest, with H = 1
+    a = a + np.pad(v[1:-1], 1)
 
-    a[0] = h**2
-    a[numberPoints] = h**2
+    return _assemble(bands + [a] + bands, [-o for o in offsets] + [0] +
+                     offsets, format, _precision(v))
 
-    b[0] = 0
-    b[numberPoints-1] = 0
 
-    A = sp.diags(a, 0) + sp.diags(b, 1) + sp.diags(b, -1)
-    return (1./h**2) * A
+def _grid(numberPoints, domainStart, domainLength):
+    """
+    Return the coordinates of all the points of a grid with numberPoints per
+    axis, one array per axis, flattened so that the last axis is contiguous
+    (the index is ix*n + iy in 2D and ix*n*n + iy*n + iz in 3D).
+    """
+    axes = [np.linspace(start, start + domainLength, numberPoints)
+            for start in domainStart]
+    return [c.ravel() for c in np.meshgrid(*axes, indexing='ij')]
+
 
+def _interior(numberPoints, dim):
+    """Boolean grid which is True away from the boundary points."""
+    return np.pad(np.ones((numberPoints-2,)*dim, dtype=bool), 1)
 
-def A2D(numberPoints, potentialFunc, domainStart, domainLength):
+
+def _laplacian(active, h, boundaryValue, stencilOrder=2):
+    """
+    Diagonals of the discretisation of -laplacian with the central stencil
+    of the given order ((2*dim+1)-point for order 2), for a grid flattened
+    with the last axis contiguous.
+    Inputs:
+        active: (bool array, one axis per dimension) Points where the
+            stencil is applied, the others are decoupled and get
+            boundaryValue on the diagonal.
+        h: (float) Grid spacing.
+        boundaryValue: (float) Diagonal entry of the decoupled points.
+        stencilOrder: (int) 2, 4 or 6.
+    Output:
+        Main diagonal, offsets of the couplings along each axis and their
+        diagonals (the matrix is symmetric, so -offset has the same one).
+    """
+    dim = active.ndim
+    c = _stencil(stencilOrder)
+    a = np.where(active, dim*c[0]/h**2, boundaryValue).ravel()
+
+    offsets = []
+    bands = []
+    for axis in range(dim):
+        for k in range(1, len(c)):
+            # Neighbours k points along the axis, none across the end of a
+            # line
+            lower = [slice(None)]*dim
+            upper = [slice(None)]*dim
+            lower[axis] = slice(None, -k)
+            upper[axis] = slice(k, None)
+            coupled = np.zeros(active.shape, dtype=bool)
+            coupled[tuple(lower)] = active[tuple(lower)] & \
+                active[tuple(upper)]
+
+            offset = k*int(np.prod(active.shape[axis+1:]))
+            offsets.append(offset)
+            bands.append(np.where(coupled.ravel()[:-offset], c[k]/h**2, 0))
+    return a, offsets, bands
+
+
+def _hamiltonian(active, potentialFunc, domainStart, domainLength, h,
+                 boundaryValue, format, stencilOrder=2):
+    """Assemble -laplacian + V on the grid of the boolean array active."""
+    coords = _grid(active.shape[0], domainStart, domainLength)
+    v = evaluatePotential(potentialFunc, *coords)
+
+    a, offsets, bands = _laplacian(active, h, boundaryValue, stencilOrder)
+    return _assemble(bands + [a + v] + bands,
+                     [-o for o in offsets] + [0] + offsets, format,
+                     _precision(v))
+
+
+def A2D(numberPoints, potentialFunc, domainStart, domainLength,
+        format='csc', stencilOrder=2):
     """
     Hamiltonian discretization in 2d without boundaries.
 
     Here we take hbar = 2m = 1.
     Input:
         Number of points to evaluate in each axis direction (float)
-        Potential function (vectorised function)
+        Potential (function of arrays, or array of its values on the grid)
         Location where domain starts (tuple)
         Length of domain (float)
+        Sparse format of the output (string)
+        Order of the finite difference stencil, 2, 4 or 6 (int)
     Output:
         Matrix A, the discretised Hamiltonian (scipy sparse matrix)
     """
     h = domainLength/numberPoints  # dx
+    n = numberPoints-1
 
-    o = np.ones(numberPoints-1)
-    x = np.linspace(domainStart[0], domainStart[0] + domainLength,
-                    numberPoints-1)
-    y = np.linspace(domainStart[1], domainStart[1] + domainLength,
-                    numberPoints-1)
-    x = np.kron(x, o)
-    y = np.kron(o, y)
-    v = potentialFunc(x, y)
+    return _hamiltonian(np.ones((n, n), dtype=bool), potentialFunc,
+                        domainStart, domainLength, h, 0, format,
+                        stencilOrder)
 
-    a = np.ones(numberPoints-1)*(2)
-    b = np.ones(numberPoints-2)*(-1)
 
-    Id = np.identity(numberPoints-1)
+def A2Dfull(numberPoints, potentialFunc, domainStart, domainLength,
+            format='csc', stencilOrder=2):
+    """
+    Hamiltonian discretization in 2D with dirichlet boundary conditions.
 
-    A1d = sp.diags(a, 0) + sp.diags(b, 1) + sp.diags(b, -1)
-    A = sp.kron(Id, A1d) + sp.kron(A1d, Id) + h**2 * sp.diags(v, 0)
-    return (1./h**2) * A
+    The boundary points are decoupled from the rest and keep H = 1 + V.
+    Input:
+        Number of points to evaluate in each axis direction (float)
+        Potential (function of arrays, or array of its values on the grid)
+        Location where domain starts (tuple)
+        Length of domain (float)
+        Sparse format of the output (string)
+        Order of the finite difference stencil, 2, 4 or 6 (int)
+    Output:
+        Matrix A, the discretised Hamiltonian (scipy sparse matrix)
+    """
+    h = domainLength/numberPoints
+    n = numberPoints+1
 
+    return _hamiltonian(_interior(n, 2), potentialFunc, domainStart,
+                        domainLength, h, 1, format, stencilOrder)
 
-def _Ih(numberPoints):
-    """Return Identity matrix of given length with zeros on the extremes."""
-    Id = np.ones(numberPoints+1)
-    Id[0] = 0
-    Id[numberPoints] = 0
-    return sp.diags(Id)
 
+def A3D(numberPoints, potentialFunc, domainStart, domainLength,
+        format='csc', stencilOrder=2):
+    """
+    Hamiltonian discretization in 3d without boundaries (7-point stencil).
 
-def _Th(numberPoints, domainLength):
-    """Create a section of the matrix A."""
+    Here we take hbar = 2m = 1.
+    Input:
+        Number of points to evaluate in each axis direction (float)
+        Potential (function of arrays, or array of its values on the grid)
+        Location where domain starts (tuple)
+        Length of domain (float)
+        Sparse format of the output (string)
+        Order of the finite difference stencil, 2, 4 or 6 (int)
+    Output:
+        Matrix A, the discretised Hamiltonian (scipy sparse matrix)
+    """
+    h = domainLength/numberPoints  # dx
+    n = numberPoints-1
+
+    return _hamiltonian(np.ones((n, n, n), dtype=bool), potentialFunc,
+                        domainStart, domainLength, h, 0, format,
+                        stencilOrder)
+
+
+def A3Dfull(numberPoints, potentialFunc, domainStart, domainLength,
+            format='csc', stencilOrder=2):
+    """
+    Hamiltonian discretization in 3D with dirichlet boundary conditions.
+
+    The boundary points are decoupled from the rest and keep H = 1 + V.
+    Input:
+        Number of points to evaluate in each axis direction (float)
+        Potential (function of arrays, or array of its values on the grid)
+        Location where domain starts (tuple)
+        Length of domain (float)
+        Sparse format of the output (string)
+        Order of the finite difference stencil, 2, 4 or 6 (int)
+    Output:
+        Matrix A, the discretised Hamiltonian (scipy sparse matrix)
+    """
     h = domainLength/numberPoints
+    n = numberPoints+1
+
+    return _hamiltonian(_interior(n, 3), potentialFunc, domainStart,
+                        domainLength, h, 1, format, stencilOrder)
+
+
+def gradedAxis(start, length, numberPoints, centers, width, refinement):
+    """
+    Coordinates of a graded grid along one axis, refined around the given
+    centers. The density of points is proportional to
+        1 + (refinement - 1) sum_c exp(-((x - c)/width)^2)
+    so the spacing near a center is about refinement times smaller than
+    far from all of them.
+    Inputs:
+        start, length: (float) The interval of the axis.
+        numberPoints: (int) Number of points, including both ends.
+        centers: (list of float) Positions to refine around.
+        width: (float) Width of the refined regions.
+        refinement: (float) Ratio of the coarsest to the finest spacing.
+    Output:
+        x (numpy vector)
+    """
+    s = np.linspace(start, start + length, 64*numberPoints)
+    density = np.ones_like(s)
+    for c in np.atleast_1d(centers):
+        density += (refinement - 1)*np.exp(-((s - c)/width)**2)
+    cumulative = np.concatenate(([0], np.cumsum((density[1:] +
+                                                density[:-1])/2)))
+    return np.interp(np.linspace(0, cumulative[-1], numberPoints),
+                     cumulative, s)
+
+
+def axisStencil(x):
+    """
+    Three point discretisation of -d^2/dx^2 on the non-uniform points x,
+    taking psi = 0 on virtual points beyond the ends (at the distance of
+    the first and last spacings). With the spacings h_i+1/2 = x_i+1 - x_i
+    and the cell sizes w_i = (h_i-1/2 + h_i+1/2)/2, it is
+        (-psi'')_i = (K psi)_i / w_i,
+        (K psi)_i = (psi_i - psi_i-1)/h_i-1/2 + (psi_i - psi_i+1)/h_i+1/2
+    which is symmetric for the inner product weighted by w. The operator
+    returned is the symmetric W^-1/2 K W^-1/2, acting on phi = W^1/2 psi,
+    whose plain norm is the weighted norm of psi.
+    Input:
+        x: (numpy vector) Increasing coordinates.
+    Outputs:
+        weights: (numpy vector) Cell sizes w_i.
+        diagonal: (numpy vector) K_ii/w_i.
+        couplings: (numpy vector) 1/(h_i+1/2 sqrt(w_i w_i+1)), the
+            operator has -couplings on its off diagonals.
+    """
+    x = np.asarray(x, dtype=float)
+    spacing = np.diff(x)
+    h = np.concatenate(([spacing[0]], spacing, [spacing[-1]]))
+    weights = (h[:-1] + h[1:])/2
+    diagonal = (1/h[:-1] + 1/h[1:])/weights
+    couplings = 1/(spacing*np.sqrt(weights[:-1]*weights[1:]))
+    return weights, diagonal, couplings
+
+
+def _weightedLaplacian(axes, active, boundaryValue):
+    """
+    Same as _laplacian for the tensor product grid of the coordinate
+    arrays axes, with the symmetric stencil of axisStencil along each axis.
+    """
+    dim = len(axes)
+    a = np.zeros(active.shape)
+    offsets = []
+    bands = []
+    for axis, x in enumerate(axes):
+        weights, diagonal, couplings = axisStencil(x)
+        shape = [1]*dim
+        shape[axis] = -1
+        a = a + diagonal.reshape(shape)
+
+        lower = [slice(None)]*dim
+        upper = [slice(None)]*dim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        band = np.zeros(active.shape)
+        shape[axis] = len(couplings)
+        band[tuple(lower)] = np.where(active[tuple(lower)] &
+                                      active[tuple(upper)],
+                                      couplings.reshape(shape), 0)
+
+        offset = int(np.prod(active.shape[axis+1:]))
+        offsets.append(offset)
+        bands.append(-band.ravel()[:-offset])
+    a = np.where(active, a, boundaryValue).ravel()
+    return a, offsets, bands
+
+
+def AGraded(axes, potentialFunc, dirichletBC, format='csc'):
+    """
+    Hamiltonian discretization on a non-uniform tensor product grid, in
+    1, 2 or 3D, acting on phi = W^1/2 psi (see axisStencil).
 
-    a = np.ones(numberPoints+1)*4.
-    b = np.ones(numberPoints)*(-1)
+    Without boundaries psi vanishes beyond the ends of the axes. With
+    Dirichlet boundaries the first and last points of every axis are
+    decoupled boundary points, with H = 1 in 1D and H = 1 + V otherwise,
+    like A1Dfull and A2Dfull.
+    Input:
+        Coordinates of the points along each axis (list of numpy vectors)
+        Potential (function of arrays, or array of its values on the grid)
+        Dirichlet boundaries (Boolean)
+        Sparse format of the output (string)
+    Output:
+        Matrix A, the discretised Hamiltonian (scipy sparse matrix)
+    """
+    shape = tuple(len(x) for x in axes)
+    coords = [c.ravel() for c in np.meshgrid(*axes, indexing='ij')]
+    v = evaluatePotential(potentialFunc, *coords)
+
+    if dirichletBC:
+        active = np.pad(np.ones(tuple(n - 2 for n in shape), dtype=bool), 1)
+        if len(axes) == 1:
+            v = np.where(active, v, 0)
+    else:
+        active = np.ones(shape, dtype=bool)
+
+    a, offsets, bands = _weightedLaplacian(axes, active, 1)
+    return _assemble(bands + [a + v] + bands,
+                     [-o for o in offsets] + [0] + offsets, format,
+                     _precision(v))
 
-    a[0] = h**2
-    a[numberPoints] = h**2
 
-    b[0] = 0
-    b[numberPoints-1] = 0
+def secondDifference(psi, axis, h):
+    """
+    Apply the 3-point discretisation of -d^2/dx^2 along one axis of psi,
+    taking psi = 0 outside of the array.
+    Inputs:
+        psi: (numpy array) Wavefunction on the grid.
+        axis: (int) Axis along which the derivative is taken.
+        h: (float) Grid spacing.
+    Output:
+        (numpy array) Same shape as psi.
+    """
+    psi = np.moveaxis(psi, axis, -1)
+    out = 2*psi
+    out[..., 1:] -= psi[..., :-1]
+    out[..., :-1] -= psi[..., 1:]
+    return np.moveaxis(out, -1, axis) / h**2
 
-    T = sp.diags(a, 0) + sp.diags(b, -1) + sp.diags(b, 1)
-    return T
 
+class StencilHamiltonian(sla.LinearOperator):
+    """
+    Matrix-free version of the Hamiltonians above, H = -laplacian + V.
+
+    Instead of storing the sparse matrix, H psi is computed with array
+    slicing on the (N, N) (or (N,), (N, N, N)) view of psi. It gives the
+    same result as the matrix of A1D/A2D/A3D, or A1Dfull/A2Dfull/A3Dfull
+    with Dirichlet boundaries (AGraded on non-uniform grids), and can be
+    used wherever scipy expects a LinearOperator, e.g. in the iterative
+    solvers.
+    """
 
-def A2Dfull(numberPoints, potentialFunc, domainStart, domainLength):
-    """Hamiltonian discretization in 2D with dirichlet boundary conditions."""
-    h = domainLength/numberPoints
-    a = np.ones(numberPoints+1)
-    b = np.ones(numberPoints)*(-1)
-    b2 = np.zeros(numberPoints+1)
-    a[0] = 0
-    a[numberPoints] = 0
-    b[0] = 0
-    b[numberPoints-1] = 0
-    b2[0] = 1
-    b2[numberPoints] = 1
-
-    Center1 = sp.diags(a, 0)
-    Center2 = sp.diags(b, 1)
-    Center3 = sp.diags(b, -1)
-    Bounds = sp.diags(b2, 0)
-
-    T = _Th(numberPoints, domainLength)
-    Id = _Ih(numberPoints)
-    I_N = (h**2)*sp.identity(numberPoints+1)
-
-    o = np.ones(numberPoints+1)
-    x = np.linspace(domainStart[0], domainStart[0] + domainLength,
-                    numberPoints+1)
-    y = np.linspace(domainStart[1], domainStart[1] + domainLength,
-                    numberPoints+1)
-    x = np.kron(x, o)
-    y = np.kron(o, y)
-    v = potentialFunc(x, y)
-
-    A = sp.kron(Center1, T) + sp.kron(Center2, Id) + sp.kron(Center3, Id) \
-      + sp.kron(Bounds, I_N) + (h**2 * sp.diags(v, 0))
-    return (1./h**2)*A
+    def __init__(self, potential, dirichletBC, numberPoints, domainLength,
+                 axes=None, stencilOrder=2):
+        """
+        Inputs:
+            potential: (numpy array, shape (allPoints,)*dim) The potential
+                evaluated on the grid.
+            dirichletBC: (Boolean) Whether the grid includes the boundary
+                points.
+            numberPoints: (int) Number of points per axis.
+            domainLength: (float) Length of the domain.
+            axes: (list of numpy vectors) Coordinates of a non-uniform
+                grid along each axis, by default the grid is uniform.
+            stencilOrder: (int) Order of the stencil on uniform grids, 2, 4
+                or 6.
+        """
+        size = potential.size
+        super().__init__(dtype=np.result_type(potential, np.complex64),
+                         shape=(size, size))
+        self.gridShape = potential.shape
+        self.dirichletBC = dirichletBC
+        self.h = domainLength/numberPoints
+        dim = potential.ndim
+
+        if dirichletBC:
+            self.active = (Ellipsis,) + (slice(1, -1),)*dim
+        else:
+            self.active = (Ellipsis,) + (slice(None),)*dim
+
+        # Kinetic part of the diagonal, and the couplings along each axis
+        # of a non-uniform grid between the active points
+        self.stencil = _stencil(stencilOrder)
+        self.kinetic = dim*self.stencil[0]/self.h**2
+        self.couplings = None
+        if axes is not None:
+            if stencilOrder != 2:
+                raise ValueError("Non-uniform grids use the 2nd order "
+                                 "stencil.")
+            self.kinetic = 0
+            self.couplings = []
+            inner = slice(1, -1) if dirichletBC else slice(None)
+            for axis, x in enumerate(axes):
+                weights, diagonal, couplings = axisStencil(x)
+                shape = [1]*dim
+                shape[axis] = -1
+                self.kinetic = self.kinetic + diagonal[inner].reshape(shape)
+                self.couplings.append(couplings[inner].reshape(shape).astype(
+                    _precision(potential.real)))
+        self.setPotential(potential)
+
+    def setPotential(self, potential):
+        """Change the potential, e.g. for time dependent systems."""
+        dim = potential.ndim
+        self.potential = potential
+        dtype = _precision(potential)
+        self.diagonal = (self.kinetic + potential[self.active]).astype(dtype)
+
+        if self.dirichletBC:
+            # Decoupled boundary points, with H = 1 (1 + V in 2D and 3D)
+            self.edgeValue = np.ones(potential.shape, dtype=dtype)
+            if dim > 1:
+                self.edgeValue = self.edgeValue + potential
+        else:
+            self.edgeValue = None
+
+    def apply(self, psi):
+        """Return H psi, for psi with the grid shape (plus batch axes)."""
+        dim = len(self.gridShape)
+        u = psi[self.active]
+
+        out = self.diagonal*u
+        for axis in range(-dim, 0):
+            if self.couplings is not None:
+                c = self.couplings[axis]
+                lower, upper = self._neighbours(axis, 1)
+                out[lower] -= c*u[upper]
+                out[upper] -= c*u[lower]
+                continue
+            for k in range(1, len(self.stencil)):
+                # psi is 0 beyond the active points
+                w = u*(self.stencil[k]/self.h**2)
+                lower, upper = self._neighbours(axis, k)
+                out[lower] += w[upper]
+                out[upper] += w[lower]
+
+        if self.edgeValue is None:
+            return out
+        new = self.edgeValue*psi
+        new[self.active] = out
+        return new
+
+    def _neighbours(self, axis, k):
+        """Slices of the points and their neighbours k points along axis."""
+        dim = len(self.gridShape)
+        lower = [Ellipsis] + [slice(None)]*dim
+        upper = [Ellipsis] + [slice(None)]*dim
+        lower[axis] = slice(None, -k)
+        upper[axis] = slice(k, None)
+        return tuple(lower), tuple(upper)
+
+    def _matvec(self, x):
+        return self.apply(x.reshape(self.gridShape)).ravel()
+
+    def _matmat(self, X):
+        # The columns of X are the states
+        X = X.T.reshape((-1,) + self.gridShape)
+        return self.apply(X).reshape(X.shape[0], -1).T
+
+    def _rmatvec(self, x):
+        # H is symmetric, so its adjoint is its complex conjugate
+        return np.conj(self._matvec(np.conj(x)))
+
+    def _rmatmat(self, X):
+        return np.conj(self._matmat(np.conj(X)))
+
+    def shifted(self, scale):
+        """Return the LinearOperator 1 + scale*H, e.g. the A or B of CN."""
+        def matvec(x):
+            return x + scale*self.dot(x)
+        return sla.LinearOperator(self.shape, matvec=matvec, matmat=matvec,
+                                  dtype=self.dtype)
@@ -0,0 +1,196 @@
+"""
+observables.py
+Expectation values measured while a simulation evolves. All the quantities
+that only depend on |psi|^2 (norm, position, spread, region probabilities)
+are moments of the density against precomputed weight vectors, so they are
+obtained together with one matrix product per sample.
+
+Created on: 18-10-2026.
+"""
+import numpy as np
+
+
+class Observables:
+    """
+    Samples a set of observables of a Simulation every few steps into
+    preallocated arrays, results[name] of shape (numberSamples,) + batch
+    (+ (dim,) for vector quantities). Sample i is taken at times[i].
+
+    The available observables are
+        "norm": sum of |psi|^2.
+        "position": <x>, one value per axis.
+        "spread": sqrt(<x^2> - <x>^2), one value per axis.
+        "momentum": <p> = <-i d/dx>, one value per axis.
+        "energy": <H>, with the current potential of the simulation.
+    and the probability in a region, added with addRegion. Expectation
+    values are divided by the norm.
+
+    Usage:
+        obs = Observables(sim, 100, every=10,
+                          names=["norm", "position", "energy"])
+        for i in range(1000):
+            sim.evolve()
+        obs.results["position"]
+    """
+
+    def __init__(self, sim, numberSamples, every=1, names=("norm",)):
+        """
+        Attach to the simulation, which takes a sample every few steps.
+        Inputs:
+            sim: (Simulation) The simulation to measure.
+            numberSamples: (int) Size of the preallocated arrays.
+            every: (int) Take one sample every this many steps.
+            names: (list of str) Observables to measure, more can be added
+                with add and addRegion before sampling.
+        """
+        self.sim = sim
+        self.numberSamples = numberSamples
+        self.every = every
+        self.steps = 0
+        self.samples = 0
+        self.times = np.zeros(numberSamples)
+        self.results = {}
+
+        self._batch = sim.psi.shape[:-1]
+        self._coordinates = self._gridCoordinates()
+        # Weight vectors against which the density is summed, and the
+        # columns of the product that belong to every result
+        self._weights = [np.ones(self._coordinates.shape[0])]
+        self._moments = {"norm": [0]}
+        self._functions = {}
+        self._densityTerms = np.array(self._weights).T
+
+        for name in names:
+            self.add(name)
+        sim.callbacks.append(self)
+
+    def _gridCoordinates(self):
+        """(grid, dim) array with the coordinates of every grid point."""
+        if self.sim.dim == 1:
+            axes = [self.sim.domain()]
+        else:
+            axes = [np.ravel(axis) for axis in self.sim.domain()]
+        grid = np.meshgrid(*axes, indexing='ij')
+        return np.stack([g.ravel() for g in grid], axis=-1)
+
+    def _addWeights(self, name, weights):
+        """Add weight columns, with shape (grid,) or (grid, m)."""
+        weights = weights.reshape(len(weights), -1)
+        start = len(self._weights)
+        self._weights.extend(weights.T)
+        self._moments[name] = list(range(start, start + weights.shape[1]))
+
+    def _allocate(self, name, shape=()):
+        self.results[name] = np.zeros((self.numberSamples,) + self._batch +
+                                      shape)
+
+    def add(self, name, function=None):
+        """
+        Add an observable. With a function it is a custom one, called as
+        function(sim, density) and returning an array of the batch shape.
+        """
+        dim = self.sim.dim
+        if function is not None:
+            self._functions[name] = function
+            self._allocate(name)
+        elif name == "norm":
+            self._allocate(name)
+        elif name in ("position", "spread"):
+            # The spread also needs the first moments
+            if "position" not in self._moments:
+                self._addWeights("position", self._coordinates)
+            if name == "spread":
+                self._addWeights("spread", self._coordinates**2)
+            self._allocate(name, (dim,))
+        elif name in ("momentum", "energy"):
+            if name == "momentum" and self.sim.weights is not None:
+                raise ValueError("The momentum needs a uniform grid.")
+            self._functions[name] = None
+            self._allocate(name, (dim,) if name == "momentum" else ())
+        else:
+            raise ValueError("Unknown observable " + name)
+        self._densityTerms = np.array(self._weights).T
+
+    def addRegion(self, name, region):
+        """
+        Add the probability of finding the particle in a region.
+        Inputs:
+            name: (str) Name of the result.
+            region: (function or numpy array) Boolean mask on the grid, or
+                a function of the coordinates, like the potential, which is
+                nonzero inside the region.
+        """
+        mask = self.sim.getPotential(region) != 0
+        self._addWeights(name, mask.ravel().astype(float))
+        self._allocate(name)
+        self._densityTerms = np.array(self._weights).T
+
+    def _momentum(self, psi):
+        """
+        <-i d/dx> along every axis with central differences,
+            sum conj(psi_j) (psi_j+1 - psi_j-1)/(2ih) = Im(sum conj(psi_j)
+            psi_j+1)/h
+        """
+        sim = self.sim
+        psi = psi.reshape(self._batch + (sim.allPoints,)*sim.dim)
+        h = sim.domainLength/sim.numberPoints
+        axes = tuple(range(-sim.dim, 0))
+        p = []
+        for axis in axes:
+            n = psi.shape[axis]
+            left = np.take(psi, range(n - 1), axis=axis)
+            right = np.take(psi, range(1, n), axis=axis)
+            p.append(np.sum(np.conj(left)*right, axis=axes).imag/h)
+        return np.stack(p, axis=-1)
+
+    def _energy(self, psi):
+        """<H>, reusing the matvec of the simulation's Hamiltonian."""
+        Hpsi = self.sim.hamiltonian.dot(psi.T).T
+        return np.sum(np.conj(psi)*Hpsi, axis=-1).real
+
+    def __call__(self, sim):
+        """Called by the simulation after every step."""
+        self.steps += 1
+        if self.steps % self.every == 0:
+            self.sample()
+
+    def sample(self):
+        """Measure all the observables on the current state."""
+        if self.samples >= self.numberSamples:
+            raise ValueError("More than numberSamples samples taken.")
+        i = self.samples
+        psi = self.sim.psi
+        density = psi.real**2 + psi.imag**2
+        moments = density.dot(self._densityTerms)
+        norm = moments[..., 0]
+
+        for name, columns in self._moments.items():
+            if name in ("position", "spread"):
+                continue
+            if name in self.results:
+                self.results[name][i] = moments[..., columns[0]]
+        if "position" in self._moments:
+            mean = moments[..., self._moments["position"]]/norm[..., None]
+            if "position" in self.results:
+                self.results["position"][i] = mean
+            if "spread" in self.results:
+                square = moments[..., self._moments["spread"]]
+                variance = square/norm[..., None] - mean**2
+                self.results["spread"][i] = np.sqrt(np.maximum(variance, 0))
+
+        for name, function in self._functions.items():
+            if name == "momentum" and function is None:
+                value = self._momentum(psi)/norm[..., None]
+            elif name == "energy" and function is None:
+                value = self._energy(psi)/norm
+            else:
+                value = function(self.sim, density)
+            self.results[name][i] = value
+
+        self.times[i] = self.sim.time
+        self.samples += 1
+
+    def detach(self):
+        """Stop sampling."""
+        if self in self.sim.callbacks:
+            self.sim.callbacks.remove(self)
@@ -29,17 +29,11 @@ def potentialWell(x):
     '''A top hat potential function.'''
     mag = 200
     domain = [6, 10]
-    if domain[0] < x < domain[1]:
-        return mag
-    else:
-        return 0
-
-
-potentialFunc = np.vectorize(potentialWell)
+    return np.where((domain[0] < x) & (x < domain[1]), mag, 0)
 
 
 # Create the simulation for the system
-sim = sm.Simulation(dim=dim, potentialFunc=potentialFunc,
+sim = sm.Simulation(dim=dim, potentialFunc=potentialWell,
                     dirichletBC=dirichletBC, numberPoints=numberPoints,
                     startPoint=startPoint, domainLength=domainLength,
                     dt=dt)
@@ -48,5 +42,5 @@ sim = sm.Simulation(dim=dim, potentialFunc=potentialFunc,
 sim.setPsiPulse(pulse="plane", energy=500, center=2)
 
 # System evolution and Animation
-ani = qplots.animation1D(sim, psi='real', V=potentialFunc)
+ani = qplots.animation1D(sim, psi='real', V=potentialWell)
 plt.show()
@@ -0,0 +1,288 @@
+"""
+profiling.py
+Instrumentation of a simulation: where the time of a run goes, phase by
+phase, how many iterations the iterative solvers need and how far they
+are from converging, and how much the norm of psi drifts.
+
+The profiler wraps the methods of the phases on the simulation instance
+(operator build, potential evaluation and updates, the explicit product
+B psi, the solve, the engine step and every callback), so a simulation
+without a profiler runs exactly the code it runs without this module.
+Each phase gets its exclusive time: a phase called inside another one,
+e.g. the solve inside the step, is not counted twice.
+
+Usage:
+    with Profiler(sim, every=100) as profiler:
+        profiler.hooks.append(lambda metrics: log.info(metrics))
+        for i in range(1000):
+            sim.evolve()
+    # the summary is printed when the block ends
+
+Created on: 18-10-2026.
+"""
+import contextlib
+import time
+import numpy as np
+import propagators
+import solvers
+
+# Methods of Simulation that are timed, and the phase they belong to
+PHASES = {"_getHamiltonian": "operators",
+          "_evaluate": "potential",
+          "_updatePotential": "update",
+          "_explicitStep": "explicit",
+          "_staticStep": "step",
+          "_magnusStep": "step",
+          "evolveAdaptive": "step"}
+
+
+class Profiler:
+    """
+    Timers and counters of the phases of a simulation, attached with
+    Profiler(sim) or with Simulation(..., profiler=Profiler()), which also
+    times the construction of the operators.
+
+    Every phase has its total exclusive time in seconds[name] and its
+    number of calls in calls[name]. The phases are
+        "operators": building the Hamiltonian matrix.
+        "potential": evaluating the potential on the grid.
+        "update": updating the operators to a time dependent potential.
+        "explicit": the product B psi of the CN engine.
+        "solve": the linear solves of the CN engine (and of the stages of
+            its order 4 and 6 propagators).
+        "factorise": the first solve after A changed, which makes its
+            solver (the factorisation).
+        "step": the rest of a step, the whole step of the other engines.
+        "callback <name>": every callback of the simulation.
+        "plot": drawing the frames of quantum_plots.
+    and the phases added with phase(name) around any code.
+
+    Every `every` steps the metrics of the last steps are passed to the
+    functions in self.hooks, as a dict with the keys
+        "step", "time": Step count and simulation time.
+        "seconds": (dict) Time of every phase over the last steps.
+        "iterations": Largest number of iterations of a solve (or matrix
+            vector products of a Krylov step), None if there was none.
+        "residual": Largest relative residual ||A x - b||/||b|| of an
+            iterative solve, None if there was none.
+        "normDrift": Simulation.normDrift of the current state.
+    """
+
+    def __init__(self, sim=None, every=100, residuals=True):
+        """
+        Inputs:
+            sim: (Simulation) Simulation to attach to, if any.
+            every: (int) Steps between reports to the hooks, and between
+                samples of the norm drift.
+            residuals: (Boolean) Whether to compute the residual of the
+                iterative solves, which costs a product with A.
+        """
+        self.every = every
+        self.residuals = residuals
+        self.hooks = []
+        self.sim = None
+        self.seconds = {}
+        self.calls = {}
+        self.steps = 0
+        self.iterations = []
+        self.residualValues = []
+        self.normDrifts = []
+        # Time of the children of the running phases
+        self._stack = []
+        self._interval = {}
+        self._worst = {"iterations": None, "residual": None}
+        self._started = time.perf_counter()
+        if sim is not None:
+            self.attach(sim)
+
+    def attach(self, sim):
+        """Wrap the phases of the simulation."""
+        self.sim = sim
+        sim.profiler = self
+        for method, name in PHASES.items():
+            setattr(sim, method, self._timed(name, getattr(sim, method)))
+        sim._solve = self._timedSolve(sim._solve)
+        sim._stepDone = self._stepDone
+        self._started = time.perf_counter()
+        if getattr(sim, "_propagator", None) is not None:
+            self.attachPropagator(sim._propagator)
+
+    def attachPropagator(self, propagator):
+        """
+        Time the stage solves of a Pade propagator and record their
+        iterations, like those of the CN engine. Called by attach, or by
+        Simulation once the propagator is made.
+        """
+        if not isinstance(propagator, propagators.Pade):
+            return
+        solve = propagator._solve
+
+        def timedSolve(k, rhs):
+            solver = propagator._solvers[k]
+            new = solver is None or (propagator._outdated[k] and isinstance(
+                solver, solvers.TridiagonalSolver))
+            outdated = propagator._outdated[k] and not new
+            start = self._start()
+            try:
+                x = solve(k, rhs)
+            finally:
+                self._stop("factorise" if new else "solve", start)
+            if outdated or isinstance(propagator._solvers[k],
+                                      solvers.KrylovSolver):
+                self._recordSolve(propagator.stages[k], x, rhs,
+                                  propagator.iterations)
+            return x
+        propagator._solve = timedSolve
+
+    def detach(self):
+        """Restore the methods of the simulation."""
+        if self.sim is not None:
+            self.unwrap(self.sim)
+            if getattr(self.sim, "_propagator", None) is not None:
+                self.sim._propagator.__dict__.pop("_solve", None)
+            self.sim = None
+
+    def unwrap(self, sim):
+        """Remove the wrappers from a simulation, or from a copy of it."""
+        for method in list(PHASES) + ["_solve", "_stepDone"]:
+            sim.__dict__.pop(method, None)
+        sim.profiler = None
+
+    def _start(self):
+        self._stack.append(0.)
+        return time.perf_counter()
+
+    def _stop(self, name, start):
+        elapsed = time.perf_counter() - start
+        exclusive = elapsed - self._stack.pop()
+        if self._stack:
+            self._stack[-1] += elapsed
+        self.seconds[name] = self.seconds.get(name, 0.) + exclusive
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._interval[name] = self._interval.get(name, 0.) + exclusive
+
+    def _timed(self, name, function):
+        """Wrapper of a method that times it as the phase name."""
+        def timed(*args, **kwargs):
+            start = self._start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._stop(name, start)
+        return timed
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block of code as the phase name."""
+        start = self._start()
+        try:
+            yield
+        finally:
+            self._stop(name, start)
+
+    def _timedSolve(self, solve):
+        """Wrapper of Simulation._solve, which also records iterations."""
+        sim = self.sim
+
+        def timedSolve(rhs):
+            new = sim._solver is None
+            outdated = sim._outdated and not new
+            start = self._start()
+            try:
+                x = solve(rhs)
+            finally:
+                self._stop("factorise" if new else "solve", start)
+            # Direct solves have no iterations nor residual
+            if outdated or isinstance(sim._solver, solvers.KrylovSolver):
+                self._recordSolve(sim.A, x, rhs, sim.iterations)
+            return x
+        return timedSolve
+
+    def _recordSolve(self, A, x, rhs, iterations):
+        """Record the iterations and the residual of an iterative solve."""
+        residual = None
+        if self.residuals:
+            norm = np.linalg.norm(rhs, axis=0)
+            residual = float(np.max(np.linalg.norm(A.dot(x) - rhs, axis=0) /
+                                    np.where(norm > 0, norm, 1)))
+        self._record(iterations, residual)
+
+    def _record(self, iterations, residual):
+        self.iterations.append(iterations)
+        worst = self._worst["iterations"]
+        self._worst["iterations"] = max(iterations, worst or 0)
+        if residual is not None:
+            self.residualValues.append(residual)
+            worst = self._worst["residual"]
+            self._worst["residual"] = max(residual, worst or 0)
+
+    def _stepDone(self):
+        """Replaces Simulation._stepDone: timed callbacks and metrics."""
+        sim = self.sim
+        self.steps += 1
+        if sim.engine == "Krylov":
+            self._record(sim.iterations, None)
+        for callback in sim.callbacks:
+            name = getattr(callback, "__name__", type(callback).__name__)
+            start = self._start()
+            try:
+                callback(sim)
+            finally:
+                self._stop("callback " + name, start)
+        if self.steps % self.every == 0:
+            self._report()
+
+    def _report(self):
+        """Sample the norm drift and pass the metrics to the hooks."""
+        drift = self.sim.normDrift()
+        self.normDrifts.append(drift)
+        metrics = {"step": self.steps, "time": self.sim.time,
+                   "seconds": self._interval, "normDrift": drift}
+        metrics.update(self._worst)
+        self._interval = {}
+        self._worst = {"iterations": None, "residual": None}
+        for hook in self.hooks:
+            hook(metrics)
+
+    def summary(self):
+        """Table of the time of every phase, and the solver statistics."""
+        wall = time.perf_counter() - self._started
+        total = sum(self.seconds.values())
+        lines = ["Profile of %d steps: %.3f s in the phases, %.3f s wall "
+                 "time" % (self.steps, total, wall),
+                 "  %-24s %8s %10s %12s %6s" %
+                 ("phase", "calls", "total s", "ms per step", "%")]
+        for name in sorted(self.seconds, key=self.seconds.get,
+                           reverse=True):
+            lines.append("  %-24s %8d %10.3f %12.4f %6.1f" %
+                         (name, self.calls[name], self.seconds[name],
+                          1e3*self.seconds[name]/max(self.steps, 1),
+                          100*self.seconds[name]/(total or 1)))
+        if self.iterations:
+            lines.append("Iterations: mean %.1f, max %d over %d solves" %
+                         (np.mean(self.iterations), max(self.iterations),
+                          len(self.iterations)))
+        if self.residualValues:
+            lines.append("Residual: max %.1e" % max(self.residualValues))
+        if self.steps:
+            drift = self.sim.normDrift() if self.sim is not None else \
+                max(self.normDrifts or [float('nan')])
+            lines.append("Norm drift: %.1e" % drift)
+        return "\n".join(lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        print(self.summary())
+        self.detach()
+
+
+def phase(sim, name):
+    """
+    Context manager timing a block of code as the phase name of the
+    profiler of sim, which does nothing if sim has no profiler.
+    """
+    if sim.profiler is None:
+        return contextlib.nullcontext()
+    return sim.profiler.phase(name)
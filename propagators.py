@@ -0,0 +1,395 @@
+"""
+propagators.py
+Time evolution engines that are alternatives to the Crank-Nicholson step
+on the full Hamiltonian matrix done in simulation.py, and its higher order
+generalisation.
+
+Created on: 18-10-2026.
+"""
+from math import factorial
+import numpy as np
+from scipy.linalg import expm
+import matrix
+import solvers
+
+
+class ADI:
+    """
+    Alternating direction implicit evolution of a 2D or 3D system.
+
+    In 2D (Peaceman-Rachford) the Hamiltonian is split as H = Hx + Hy with
+        Hx = -d^2/dx^2 + V/2,    Hy = -d^2/dy^2 + V/2
+    and every time step is made of two implicit sweeps,
+        (1 + i dt/2 Hx) psi* = (1 - i dt/2 Hy) psi
+        (1 + i dt/2 Hy) psi' = (1 - i dt/2 Hx) psi*
+    In 3D, where Peaceman-Rachford is not unconditionally stable, the step
+    is the symmetric splitting
+        psi' = Cx(dt/2) Cy(dt/2) Cz(dt) Cy(dt/2) Cx(dt/2) psi
+    of the Crank-Nicholson steps Ck(tau) of Hk = -d^2/dxk^2 + V/3, each of
+    which is unitary.
+
+    Each sweep is a set of independent tridiagonal systems, one per grid
+    line, which are solved together as a single block tridiagonal system,
+    so a step costs O(N^dim). A (K, grid) block of states is solved with K
+    right hand sides.
+    """
+
+    def __init__(self, potential, dirichletBC, numberPoints, domainLength,
+                 dt):
+        """
+        Factorise the tridiagonal systems of all the sweeps.
+        Inputs:
+            potential: (numpy array, shape (allPoints,)*dim) The potential
+                evaluated on the grid.
+            dirichletBC: (Boolean) Whether the grid includes the boundary
+                points, on which psi is held by Dirichlet conditions.
+            numberPoints: (int) Number of points per axis.
+            domainLength: (float) Length of the domain.
+            dt: (float) Time step.
+        """
+        self.shape = potential.shape
+        self.h = domainLength/numberPoints
+        self.dt = dt
+        self.dirichletBC = dirichletBC
+        dim = len(self.shape)
+
+        if dirichletBC:
+            # Boundary points are decoupled from the rest, just like in
+            # matrix.A2Dfull, so they only pick up a phase every step.
+            self.active = (Ellipsis,) + (slice(1, -1),)*dim
+        else:
+            self.active = (Ellipsis,) + (slice(None),)*dim
+
+        # Sweeps as (implicit axis, dt/2 of the sweep, explicit axis)
+        if dim == 2:
+            self.sweeps = [(-2, dt/2, -1), (-1, dt/2, -2)]
+        else:
+            self.sweeps = [(-3, dt/4, -3), (-2, dt/4, -2), (-1, dt/2, -1),
+                           (-2, dt/4, -2), (-3, dt/4, -3)]
+        self.setPotential(potential)
+
+    def setPotential(self, potential):
+        """
+        Change the potential, refactorising the tridiagonal systems. This
+        is O(N^dim), about the cost of a step.
+        """
+        dim = len(self.shape)
+        if self.dirichletBC:
+            self.edgeFactor = (1 - 0.5j*self.dt*(1 + potential)) / \
+                              (1 + 0.5j*self.dt*(1 + potential))
+        else:
+            self.edgeFactor = None
+
+        self.sharedV = potential[self.active]/dim
+        self._factorise()
+
+    def _factorise(self):
+        """Factorise the tridiagonal systems of all the sweeps."""
+        self.solvers = {}
+        for axis, a, explicit in self.sweeps:
+            if (axis, a) not in self.solvers:
+                self.solvers[axis, a] = self._lineSolver(axis, a)
+
+    def _lineSolver(self, axis, a, lines=slice(None)):
+        """
+        Factorise (1 + i a H_axis) for all the lines along the axis, or for
+        the given slice of them (in 2D, of the other axis).
+        """
+        v = np.moveaxis(self.sharedV, axis, -1)[lines]
+        m = v.shape[-1]
+
+        diag = 1 + 1j*a*(2/self.h**2 + v.ravel())
+        off = np.full(diag.size - 1, -1j*a/self.h**2, dtype=diag.dtype)
+        # Consecutive lines are not coupled
+        off[m-1::m] = 0
+        return solvers.TridiagonalSolver(off, diag, off)
+
+    def _apply(self, psi, axis):
+        """Apply H_axis to psi."""
+        return (matrix.secondDifference(psi, axis, self.h) +
+                self.sharedV*psi)
+
+    def _sweep(self, rhs, axis, a):
+        """Solve (1 + i a H_axis) x = rhs for all the lines at once."""
+        rhs = np.moveaxis(rhs, axis, -1)
+        shape = rhs.shape
+        size = self.sharedV.size
+        # One column per state of the batch
+        rhs = np.ascontiguousarray(rhs).reshape(-1, size).T
+        x = self.solvers[axis, a].solve(rhs)
+        return np.moveaxis(x.T.reshape(shape), -1, axis)
+
+    def step(self, psi):
+        """Return psi, of shape (grid,) or (K, grid), evolved one step."""
+        batch = psi.shape[:-1]
+        psi = psi.reshape(batch + self.shape)
+        u = psi[self.active]
+
+        for axis, a, explicit in self.sweeps:
+            u = self._sweep(u - 1j*a*self._apply(u, explicit), axis, a)
+
+        if self.edgeFactor is not None:
+            new = self.edgeFactor*psi
+            new[self.active] = u
+            u = new
+        return u.reshape(batch + (-1,))
+
+
+class SplitOperator:
+    """
+    Split-step Fourier evolution on a periodic grid. Every time step is the
+    symmetric (Strang) splitting
+        psi' = exp(-i V dt/2) F^-1 exp(-i k^2 dt) F exp(-i V dt/2) psi
+    where F is the discrete Fourier transform, with hbar = 2m = 1. The phase
+    factors are computed once, so a step costs O(N log N) and needs no
+    linear solve. A (K, grid) block of states is transformed at once.
+    """
+
+    def __init__(self, potential, numberPoints, domainLength, dt):
+        """
+        Precompute the phase factors.
+        Inputs:
+            potential: (numpy array, shape (allPoints,)*dim) The potential
+                evaluated on the grid.
+            numberPoints: (int) Number of points per axis.
+            domainLength: (float) Length of the domain.
+            dt: (float) Time step.
+        """
+        self.shape = potential.shape
+        h = domainLength/numberPoints
+
+        k = [2*np.pi*np.fft.fftfreq(n, d=h) for n in self.shape]
+        k2 = sum(ki**2 for ki in np.meshgrid(*k, indexing='ij'))
+
+        self.dt = dt
+        # In the precision of the potential
+        dtype = np.result_type(potential, np.complex64)
+        self.kineticPhase = np.exp(-1j*k2*dt).astype(dtype)
+        self.setPotential(potential)
+
+    def setPotential(self, potential):
+        """Change the potential, recomputing its phase factor."""
+        self.potentialPhase = np.exp(-0.5j*potential*self.dt)
+
+    def step(self, psi):
+        """Return psi, of shape (grid,) or (K, grid), evolved one step."""
+        batch = psi.shape[:-1]
+        axes = tuple(range(-len(self.shape), 0))
+        psi = self.potentialPhase*psi.reshape(batch + self.shape)
+        psi = np.fft.ifftn(self.kineticPhase*np.fft.fftn(psi, axes=axes),
+                           axes=axes)
+        return (self.potentialPhase*psi).reshape(batch + (-1,))
+
+
+def padeRoots(m):
+    """
+    Roots z_k of the numerator P(z) of the (m, m) Pade approximant of
+    exp(z) = P(z)/P(-z), with
+        P(z) = sum_j (2m-j)! m! / ((2m)! j! (m-j)!) z^j
+    """
+    coefficients = [factorial(2*m - j)*factorial(m) /
+                    (factorial(2*m)*factorial(j)*factorial(m - j))
+                    for j in range(m + 1)]
+    return np.roots(coefficients[::-1])
+
+
+class Pade:
+    """
+    Evolution with the (m, m) Pade approximant of exp(-i dt H), which is
+    unitary and of order 2m. Factorising its numerator, every step is a
+    product of m Crank-Nicholson like stages
+        psi' = prod_k (1 + s_k H)^-1 (1 - s_k H) psi,   s_k = -i dt/z_k
+    with z_k the roots of padeRoots(m). m = 1 is Crank-Nicholson itself.
+    The stage matrices are factorised once and the factorisations reused
+    every step, so a step costs about m CN steps.
+    """
+
+    def __init__(self, H, dt, order=4, solver="auto", solverOptions=None):
+        """
+        Build the stage matrices.
+        Inputs:
+            H: (scipy sparse matrix) The Hamiltonian.
+            dt: (float) Time step.
+            order: (int) Even order of the method, 2m.
+            solver: (str) Backend of the stage solvers, see
+                solvers.makeSolver.
+            solverOptions: (dict) Options of the backend.
+        """
+        if order < 2 or order % 2:
+            raise ValueError("The order must be even and at least 2.")
+        self.H = H.copy()
+        self.dt = dt
+        self.order = order
+        self.solver = solver
+        self.solverOptions = solverOptions or {}
+        self.refactorIterations = 10
+        self.iterations = 0
+        self._diagonal = matrix.diagonalIndex(self.H)
+
+        self.coefficients = (-1j*dt/padeRoots(order//2)).astype(
+            np.result_type(H.dtype, np.complex64))
+        self.stages = []
+        for s in self.coefficients:
+            A = self.H*s
+            A.data[self._diagonal] += 1
+            self.stages.append(A)
+        self._solvers = [None]*len(self.stages)
+        self._outdated = [False]*len(self.stages)
+
+    def shiftPotential(self, dv):
+        """
+        Add dv to the diagonal of H, updating the stage matrices in place.
+        Their old factorisations precondition the following solves, until
+        one needs more than refactorIterations iterations.
+        """
+        self.H.data[self._diagonal] += dv
+        for s, A in zip(self.coefficients, self.stages):
+            A.data[self._diagonal] += s*dv
+        self._outdated = [True]*len(self.stages)
+
+    def _solve(self, k, rhs):
+        """Solve the system of stage k."""
+        A = self.stages[k]
+        solver = self._solvers[k]
+        if solver is None or (self._outdated[k] and isinstance(
+                solver, solvers.TridiagonalSolver)):
+            # Refactorising a tridiagonal matrix costs as much as a solve
+            solver = self._solvers[k] = solvers.makeSolver(
+                A, self.solver, **self.solverOptions)
+            self._outdated[k] = False
+        if not (self._outdated[k] and isinstance(solver, solvers.LUSolver)):
+            x = solver.solve(rhs)
+            if isinstance(solver, solvers.KrylovSolver):
+                self.iterations = solver.iterations
+            return x
+
+        x, self.iterations = solvers.preconditionedSolve(A, rhs, solver)
+        if self.iterations > self.refactorIterations:
+            self._solvers[k] = None
+        return x
+
+    def step(self, psi):
+        """Return psi, of shape (grid,) or (K, grid), evolved one step."""
+        x = psi.T
+        for k, s in enumerate(self.coefficients):
+            x = self._solve(k, x - s*self.H.dot(x))
+        return x.T
+
+
+class KrylovExponential:
+    """
+    Evolution with the exponential exp(-i dt H) psi itself, approximated in
+    the Krylov space span{psi, H psi, ..., H^(m-1) psi}: with the
+    orthonormal basis V_m and the projection H_m = V_m^* H V_m from the
+    Lanczos (Hermitian H) or Arnoldi recurrence,
+        exp(-i dt H) psi ~ |psi| V_m exp(-i dt H_m) e_1
+    which only needs m matrix-vector products with H and the exponential
+    of an m x m matrix. No matrix is factorised, so it also works where the
+    LU fill-in of the implicit methods does not fit in memory.
+
+    The dimension m grows until the estimate of the error
+        |psi| h_m+1,m |[exp(-i dt H_m)]_m,1|
+    is below the tolerance. If maxDimension is not enough, the step is
+    made of substeps, whose size is kept for the following steps.
+    """
+
+    def __init__(self, H, dt, tol=1e-10, maxDimension=40, hermitian=True):
+        """
+        Inputs:
+            H: (scipy sparse matrix or operator with a dot method) The
+                Hamiltonian, e.g. from matrix.py or a
+                matrix.StencilHamiltonian.
+            dt: (float) Time step.
+            tol: (float) Error of a step, relative to the norm of psi.
+            maxDimension: (int) Largest dimension of the Krylov space.
+            hermitian: (Boolean) Whether H is Hermitian, which allows the
+                Lanczos recurrence. False for complex potentials.
+        """
+        self.H = H
+        self.dt = dt
+        self.tol = tol
+        self.maxDimension = maxDimension
+        self.hermitian = hermitian
+        # Matrix-vector products of the last step
+        self.iterations = 0
+        # Size of the substeps, at most dt
+        self._substep = dt
+
+    def _exponential(self, tau, j, alpha, beta, Hm):
+        """exp(-i tau H_j) e_1 of the projected matrix of dimension j."""
+        if self.hermitian:
+            T = np.diag(alpha[:j]) + np.diag(beta[:j-1], 1) + \
+                np.diag(beta[:j-1], -1)
+            energies, vectors = np.linalg.eigh(T)
+            return vectors.dot(np.exp(-1j*tau*energies)*vectors[0])
+        return expm(-1j*tau*Hm[:j, :j])[:, 0]
+
+    def _krylov(self, psi, tau, budget):
+        """
+        Approximate exp(-i tau H) psi, stopping as soon as the error
+        estimate is below the budget. Returns the result, the error and
+        the dimension used.
+        """
+        norm = np.linalg.norm(psi)
+        if norm == 0:
+            return psi.copy(), 0., 0
+        m = self.maxDimension
+        V = np.empty((m + 1, len(psi)), dtype=np.result_type(psi, 1j))
+        V[0] = psi/norm
+        alpha = np.zeros(m)
+        beta = np.zeros(m)
+        Hm = None if self.hermitian else np.zeros((m + 1, m), dtype=complex)
+
+        for j in range(m):
+            w = self.H.dot(V[j])
+            self.iterations += 1
+            if self.hermitian:
+                if j > 0:
+                    w -= beta[j-1]*V[j-1]
+                alpha[j] = np.vdot(V[j], w).real
+                w -= alpha[j]*V[j]
+                beta[j] = residual = np.linalg.norm(w)
+            else:
+                # Modified Gram-Schmidt
+                for i in range(j + 1):
+                    Hm[i, j] = np.vdot(V[i], w)
+                    w -= Hm[i, j]*V[i]
+                Hm[j+1, j] = residual = np.linalg.norm(w)
+
+            c = self._exponential(tau, j + 1, alpha, beta, Hm)
+            error = norm*residual*abs(c[-1])
+            # A vanishing next vector means that the space is invariant
+            # and the result exact
+            if error <= budget or residual <= 1e-14*norm:
+                break
+            V[j+1] = w/residual
+        return norm*c.dot(V[:len(c)]), error, len(c)
+
+    def propagate(self, psi, t):
+        """Return the vector psi evolved for a time t."""
+        done = 0.
+        tau = min(self._substep, t)
+        while t - done > 1e-12*t:
+            tau = min(tau, t - done)
+            # The errors of the substeps add up to at most tol
+            budget = self.tol*np.linalg.norm(psi)*tau/t
+            new, error, dimension = self._krylov(psi, tau, budget)
+            if error > budget:
+                tau = tau/2
+                continue
+            psi = new
+            done += tau
+            # Longer substeps are tried when the space was small
+            if dimension <= self.maxDimension//2:
+                tau = 2*tau
+            self._substep = tau
+        return psi
+
+    def step(self, psi):
+        """Return psi, of shape (grid,) or (K, grid), evolved one step."""
+        self.iterations = 0
+        columns = psi.reshape(-1, psi.shape[-1])
+        out = np.empty(columns.shape, dtype=np.result_type(psi, 1j))
+        for k in range(len(columns)):
+            out[k] = self.propagate(columns[k], self.dt)
+        return out.reshape(psi.shape)
@@ -8,25 +8,33 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import os.path
+import rendering
+import profiling
 
 
-def animation1D(sim, V='none', psi='real', time=100, save=False):
+def animation1D(sim, V='none', psi='real', time=100, save=False,
+                stepsPerFrame=1):
     """
     Make an animation of a 1D system.
 
     Inputs:
         sim: (simulation object) An object of the simulation class.
         x: (N, numpy vector) x-coordinates of the domain.
-        V: (vectorised function) The potential function, or "none", to
-            indicate it should not be plotted.
+        V: (function or array) The potential, or "none", to indicate it
+            should not be plotted. The potential of sim is not evaluated
+            again.
         psi: (string) "real" or "norm" to determine whether to plot
             Re(Ψ) or |Ψ|^2
         time: (int) Number of frames to animate.
-        save: (Boolean) Whether the animation should be saved.
+        save: (Boolean) Whether the animation should be saved, see _save.
+        stepsPerFrame: (int) Time steps between frames.
     Outputs:
         Displays animation with both the evolving wavefunction norm and the
             potential function influencing it.
     """
+    if save:
+        _save(sim, psi, time, stepsPerFrame)
+
     # Animation stuff
     x = sim.domain()
     fig, ax1 = plt.subplots()
@@ -35,62 +43,65 @@ def animation1D(sim, V='none', psi='real', time=100, save=False):
         line, = ax1.plot(x, sim.realPsi())
     else:
         ax1.set_ylabel('$|\psi(x)|^2$')
-        line, = ax1.plot(x, sim.normPsi())
+        line, = ax1.plot(x, sim.densityPsi())
     ax1.tick_params('y', colors='b')
     ax1.set_xlabel('x')
 
     def animate(i):
-        sim.evolve()
-        if psi == 'real':
-            line.set_ydata(sim.realPsi())
-        else:
-            line.set_ydata(sim.normPsi())
+        for k in range(stepsPerFrame):
+            sim.evolve()
+        with profiling.phase(sim, "plot"):
+            if psi == 'real':
+                line.set_ydata(sim.realPsi())
+            else:
+                line.set_ydata(sim.densityPsi())
         return line,
 
     ani = animation.FuncAnimation(fig, animate, frames=time, interval=20,
                                   blit=True)
 
-    if V != 'none':
+    if not isinstance(V, str):
         ax2 = ax1.twinx()
-        ax2.plot(x, np.vectorize(V)(x), 'r')
+        ax2.plot(x, sim.getPotential(V), 'r')
         ax2.set_ylabel('$V(x)$')
         ax2.tick_params('y', colors='r')
 
-    if save:
-        _save(ani, sim)
-
     return ani
 
 
-def animation2D(sim, potentialFunc, psi="norm", time=100, save=False):
+def animation2D(sim, potentialFunc, psi="norm", time=100, save=False,
+                stepsPerFrame=1):
     """
-    Make a 2D animation of a 2D system.
+    Make a 2D animation of a 2D system. For 3D systems |Ψ|^2 is projected
+    along z, and Re(Ψ) and the potential are cut through the middle.
 
     Inputs:
         sim: (simulation object) An object of the simulation class.
-        potentialFunc: (vectorised function) The potential function, or
-            "none", to indicate it should not be plotted.
+        potentialFunc: (function or array) The potential, or "none", to
+            indicate it should not be plotted. The potential of sim is not
+            evaluated again.
         psi: (string) "real" or "norm" to determine whether to plot
             Re(Ψ) or |Ψ|^2
         time: (int) Number of frames to animate.
-        save: (Boolean) Whether the animation should be saved.
+        save: (Boolean) Whether the animation should be saved, see _save.
+        stepsPerFrame: (int) Time steps between frames.
     Outputs:
         Displays animation with both the evolving wavefunction norm and the
             potential function influencing it.
     """
-    domain = sim.domain()
-    allPoints = sim.allPoints
+    potentialPlot = None
+    if not isinstance(potentialFunc, str):
+        potentialPlot = sim.planeSlice(sim.getPotential(potentialFunc))
+    if save:
+        _save(sim, psi, time, stepsPerFrame, potentialPlot)
 
     fig = plt.figure()
-    im = plt.imshow(np.transpose(sim.normPsi().reshape(allPoints, allPoints)),
-                    animated=True, cmap=plt.get_cmap('jet'), alpha=.9,
-                    origin='lower')
+    im = _image(sim, sim.planeProjection(sim.densityPsi()), animated=True,
+                cmap=plt.get_cmap('jet'), alpha=.9)
 
-    if potentialFunc != 'none':
+    if potentialPlot is not None:
         # Only plot the potential if running locally, not in notebook.
-        potentialPlot = np.vectorize(potentialFunc)(domain[0], domain[1])
-        plt.imshow(potentialPlot, cmap=plt.get_cmap('Greys'), alpha=1,
-                   origin='lower')
+        _image(sim, potentialPlot, cmap=plt.get_cmap('Greys'), alpha=1)
 
     plt.xticks([])
     plt.yticks([])
@@ -99,33 +110,33 @@ def animation2D(sim, potentialFunc, psi="norm", time=100, save=False):
 
 
     def animate(i):
-        sim.evolve()
-        if psi == "norm":
-            im.set_array(np.transpose(sim.normPsi().reshape(allPoints,
-                         allPoints)))
-        else:
-            im.set_array(np.transpose(sim.realPsi().reshape(allPoints,
-                         allPoints)))
+        for k in range(stepsPerFrame):
+            sim.evolve()
+        with profiling.phase(sim, "plot"):
+            if psi == "norm":
+                im.set_array(np.transpose(sim.planeProjection(
+                    sim.densityPsi())))
+            else:
+                im.set_array(np.transpose(sim.planeSlice(sim.realPsi())))
 
         return im,
 
     ani = animation.FuncAnimation(fig, animate, frames=time, interval=60,
                                   blit=True)
 
-    if save:
-        _save(ani, sim)
-
     return ani
 
 
 def frame2D(sim, potentialFunc, psi="norm"):
     """
-    Make a 2D frame of a given psi of a 2D system.
+    Make a 2D frame of a given psi of a 2D system (or the projection along
+    z of a 3D system).
 
     Inputs:
         sim: (simulation object) An object of the simulation class.
-        potentialFunc: (vectorised function) The potential function, or
-            "none", to indicate it should not be plotted.
+        potentialFunc: (function or array) The potential, or "none", to
+            indicate it should not be plotted. The potential of sim is not
+            evaluated again.
         psi: (string) "real" or "norm" to determine whether to plot
             Re(Ψ) or |Ψ|^2
         time: (int) Number of frames to animate.
@@ -133,23 +144,32 @@ def frame2D(sim, potentialFunc, psi="norm"):
         Displays a frame with both the evolving wavefunction norm and the
             potential function influencing it.
     """
-    domain = sim.domain()
-    allPoints = sim.allPoints
 
-    if potentialFunc != 'none':
+    if not isinstance(potentialFunc, str):
         # Only plot the potential if running locally, not in notebook.
-        potentialPlot = np.vectorize(potentialFunc)(domain[0], domain[1])
-        plt.imshow(potentialPlot, cmap=plt.get_cmap('Greys'), alpha=1,
-                   origin='lower')
+        potentialPlot = sim.planeSlice(sim.getPotential(potentialFunc))
+        _image(sim, potentialPlot, cmap=plt.get_cmap('Greys'), alpha=1)
 
-    plt.imshow(np.transpose(sim.normPsi().reshape(allPoints, allPoints)),
-               cmap=plt.get_cmap('jet'), alpha=.9, origin='lower')
+    _image(sim, sim.planeProjection(sim.densityPsi()),
+           cmap=plt.get_cmap('jet'), alpha=.9)
 
     plt.xticks([])
     plt.yticks([])
     plt.xlabel(r'$x$', fontsize=18)
     plt.ylabel(r'$y$', fontsize=18)
 
+
+def _image(sim, values, **kwargs):
+    """
+    Show the (x, y) array values as an image, which follows the points of
+    a non-uniform grid.
+    """
+    if sim.axes is None:
+        return plt.imshow(np.transpose(values), origin='lower', **kwargs)
+    return plt.pcolormesh(sim.axes[0], sim.axes[1], np.transpose(values),
+                          shading='nearest', **kwargs)
+
+
 def probabilityGraph(P):
     '''
     Plots probability over time
@@ -165,26 +185,23 @@ def probabilityGraph(P):
     return fig
 
 
-def _save(ani, sim):
+def _save(sim, psi, time, stepsPerFrame=1, potential=None):
     """
-    Save animation to file. Requires installation of ffmpeg.
+    Save a movie of the evolution to a subfolder with the offline renderer
+    of rendering.py, which pipes the frames to ffmpeg without drawing them
+    with matplotlib. Requires installation of ffmpeg.
 
-    Warning: Because this is a continous animation, instead of a fixed length
-    one, this will cause the animation to not be displayed and saved instead.
-    Need to close the figure window in order to allow it to finish.
-    TODO : Fix it so that this is less hacky and doesn't cause the kernel to
-    crash.
+    The simulation is evolved while saving, the animation shown afterwards
+    continues from the last frame of the movie.
     Inputs:
-        ani: (matplotlib animation object) The animation to be saved.
         sim: (simulation object) An object of the simulation class.
+        psi: (string) "real" or "norm".
+        time: (int) Number of frames.
+        stepsPerFrame: (int) Time steps between frames.
+        potential: (array) Potential shaded in 2D movies.
     Outputs:
         A movie, saved in .mp4 format to a subfolder.
     """
-    Writer = animation.writers['ffmpeg']
-    writer = Writer(fps=60,
-                    metadata=dict(artist='Eduardo Villaseñor & Eoin Horgan'),
-                    bitrate=3000)
-
     # Make folder if it doesn't already exist
     if not os.path.exists('Saved Animations'):
         os.makedirs('Saved Animations')
@@ -200,4 +217,7 @@ def _save(ani, sim):
                             ", L = " + str(sim.domainLength) +
                             ", dBC = " + dBC +
                             ", dt = " + str(sim.dt) + '.mp4')
-    ani.save(filepath, writer=writer)
+    quantity = "density" if psi == "norm" else "real"
+    frames = rendering.simulationFrames(sim, time, stepsPerFrame, quantity)
+    rendering.writeMovie(frames, filepath, potential=potential,
+                         scale=max(1, 512//sim.allPoints))
@@ -0,0 +1,265 @@
+"""
+recorder.py
+Streams the trajectory of a simulation to disk while it evolves, so long
+runs can be kept without holding the time series in memory, and reads it
+back lazily.
+
+Two file formats are supported:
+    .npy: a memory-mapped array of shape (numberFrames,) + frame shape,
+        the times are stored next to it in <name>.times.npy.
+    .npz: a zip archive of compressed chunks of frames, with their times.
+        The number of frames does not need to be known in advance.
+
+Created on: 18-10-2026.
+"""
+import queue
+import threading
+import zipfile
+import numpy as np
+
+
+class Recorder:
+    """
+    Records snapshots of a Simulation every few steps. The snapshots are
+    buffered in chunks, which are written by a background thread, so the
+    stepping only waits on the disk if it is faster than the disk for a
+    long time.
+
+    Usage:
+        rec = Recorder(sim, 'run.npz', every=10, quantity='density')
+        for i in range(1000):
+            sim.evolve()
+        rec.close()
+        traj = Trajectory('run.npz')
+    """
+
+    def __init__(self, sim, filename, every=1, quantity="psi", downsample=1,
+                 numberFrames=None, chunkFrames=64, dtype=None,
+                 compressLevel=1):
+        """
+        Attach the recorder to the simulation and record its current state.
+        Inputs:
+            sim: (Simulation) The simulation to record.
+            filename: (str) Output file, ending in .npy or .npz.
+            every: (int) Record one snapshot every this many steps.
+            quantity: (str) "psi" for the wave function or "density" for
+                |psi|^2.
+            downsample: (int) Keep one grid point every this many points
+                along each axis.
+            numberFrames: (int) Number of frames to allocate, only needed
+                for .npy files.
+            chunkFrames: (int) Frames per buffer handed to the writer, and
+                per compressed chunk of .npz files.
+            dtype: (numpy dtype) Type of the stored values, by default the
+                type of psi or of |psi|^2.
+            compressLevel: (int) zlib level of .npz files, from 1 (fast)
+                to 9 (small).
+        """
+        if quantity not in ("psi", "density"):
+            raise ValueError("quantity must be 'psi' or 'density'.")
+        if filename.endswith(".npy"):
+            if numberFrames is None:
+                raise ValueError("numberFrames is needed for .npy files.")
+        elif not filename.endswith(".npz"):
+            raise ValueError("filename must end in .npy or .npz.")
+
+        self.sim = sim
+        self.filename = filename
+        self.every = every
+        self.quantity = quantity
+        self.downsample = downsample
+        self.chunkFrames = chunkFrames
+        self.steps = 0
+        self.frames = 0
+
+        frame = self._snapshot(sim)
+        self.shape = frame.shape
+        self.dtype = np.dtype(dtype or frame.dtype)
+        self._times = []
+
+        if filename.endswith(".npy"):
+            self._file = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=self.dtype,
+                shape=(numberFrames,) + self.shape)
+        else:
+            self._file = zipfile.ZipFile(filename, mode='w',
+                                         compression=zipfile.ZIP_DEFLATED,
+                                         compresslevel=compressLevel)
+        self.numberFrames = numberFrames
+
+        # At most two chunks wait for the writer, the stepping blocks after
+        self._queue = queue.Queue(maxsize=2)
+        self._error = None
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+        self._newBuffer()
+
+        self._add(frame, sim.time)
+        sim.callbacks.append(self)
+
+    def _snapshot(self, sim):
+        """The recorded quantity of the current state, on the grid."""
+        psi = sim.psi.reshape(sim.psi.shape[:-1] + (sim.allPoints,)*sim.dim)
+        step = self.downsample
+        psi = psi[(Ellipsis,) + (slice(None, None, step),)*sim.dim]
+        if self.quantity == "density":
+            return np.abs(psi)**2
+        return psi
+
+    def _newBuffer(self):
+        self._buffer = np.empty((self.chunkFrames,) + self.shape,
+                                dtype=self.dtype)
+        self._start = self.frames
+        self._filled = 0
+
+    def _add(self, frame, time):
+        """Copy a frame to the buffer, handing it to the writer when full."""
+        if self._error is not None:
+            raise self._error
+        full = self.numberFrames is not None and \
+            self.frames >= self.numberFrames
+        if full:
+            raise ValueError("More than numberFrames frames recorded.")
+        self._buffer[self._filled] = frame
+        self._times.append(time)
+        self._filled += 1
+        self.frames += 1
+        if self._filled == self.chunkFrames:
+            self._flushBuffer()
+
+    def _flushBuffer(self):
+        if self._filled:
+            times = np.array(self._times[self._start:self.frames])
+            self._queue.put((self._start, self._buffer[:self._filled],
+                             times))
+        self._newBuffer()
+
+    def _write(self):
+        """Writer thread, takes chunks from the queue until None."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            start, frames, times = item
+            try:
+                if isinstance(self._file, zipfile.ZipFile):
+                    self._writeEntry('frames%08d.npy' % start, frames)
+                    self._writeEntry('times%08d.npy' % start, times)
+                else:
+                    self._file[start:start + len(frames)] = frames
+            except Exception as error:
+                self._error = error
+
+    def _writeEntry(self, name, array):
+        with self._file.open(name, mode='w', force_zip64=True) as entry:
+            np.lib.format.write_array(entry, np.ascontiguousarray(array),
+                                      allow_pickle=False)
+
+    def __call__(self, sim):
+        """Called by the simulation after every step."""
+        self.steps += 1
+        if self.steps % self.every == 0:
+            self._add(self._snapshot(sim), sim.time)
+
+    def close(self):
+        """
+        Write the remaining frames, wait for the writer and detach from the
+        simulation.
+        """
+        if self._writer is None:
+            return
+        if self in self.sim.callbacks:
+            self.sim.callbacks.remove(self)
+        self._flushBuffer()
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+        if isinstance(self._file, zipfile.ZipFile):
+            self._file.close()
+        else:
+            self._file.flush()
+            del self._file
+            np.save(timesFile(self.filename), np.array(self._times))
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def timesFile(filename):
+    """Name of the file with the times of a .npy trajectory."""
+    return filename[:-len(".npy")] + ".times.npy"
+
+
+class Trajectory:
+    """
+    Lazy reader of a recorded trajectory. Frames are only read from disk
+    when indexed, traj[i] or traj[i:j:k], and the times are in traj.times.
+    """
+
+    def __init__(self, filename):
+        """
+        Open the file written by a Recorder.
+        Input:
+            filename: (str) The .npy or .npz file.
+        """
+        self.filename = filename
+        if filename.endswith(".npy"):
+            self.times = np.load(timesFile(filename))
+            self._frames = np.load(filename, mmap_mode='r')
+            self._chunks = None
+            self.shape = self._frames.shape[1:]
+            self.dtype = self._frames.dtype
+        else:
+            self._archive = np.load(filename)
+            starts = sorted(int(name[len('frames'):])
+                            for name in self._archive.files
+                            if name.startswith('frames'))
+            self.times = np.concatenate(
+                [self._archive['times%08d' % s] for s in starts])
+            self._chunks = np.array(starts + [len(self.times)])
+            self._cached = (None, None)
+            first = self._chunk(0)
+            self.shape = first.shape[1:]
+            self.dtype = first.dtype
+
+    def __len__(self):
+        return len(self.times)
+
+    def _chunk(self, c):
+        """Frames of chunk c, the last chunk read is kept in memory."""
+        if self._cached[0] != c:
+            self._cached = (c, self._archive['frames%08d' % self._chunks[c]])
+        return self._cached[1]
+
+    def __getitem__(self, index):
+        if self._chunks is None:
+            return np.asarray(self._frames[:len(self)][index])
+        if isinstance(index, slice):
+            indices = range(*index.indices(len(self)))
+            frames = np.empty((len(indices),) + self.shape, dtype=self.dtype)
+            for k, i in enumerate(indices):
+                frames[k] = self[i]
+            return frames
+
+        i = range(len(self))[index]
+        c = np.searchsorted(self._chunks, i, side='right') - 1
+        return self._chunk(c)[i - self._chunks[c]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        """Release the file."""
+        if self._chunks is None:
+            del self._frames
+        else:
+            self._archive.close()
@@ -0,0 +1,217 @@
+"""
+rendering.py
+Offline rendering of movies, decoupled from the time evolution. Frames
+come from a recorded trajectory (recorder.Trajectory) or are streamed from
+a running simulation, several steps per frame. They are turned into RGB
+images with a colormap lookup table, without matplotlib figures, by a pool
+of worker processes, and the raw images are piped into ffmpeg. The
+simulation, the colouring and the encoding then run in parallel.
+
+Usage:
+    frames = simulationFrames(sim, 1000, stepsPerFrame=5)
+    writeMovie(frames, 'run.mp4', potential=sim.potential)
+
+Created on: 18-10-2026.
+"""
+import multiprocessing
+import subprocess
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def simulationFrames(sim, numberFrames, stepsPerFrame=1, quantity="density"):
+    """
+    Generator of frames of a running simulation, the first one being the
+    current state.
+    Inputs:
+        sim: (Simulation) The simulation, which is evolved.
+        numberFrames: (int) Number of frames.
+        stepsPerFrame: (int) Time steps between frames.
+        quantity: (str) "density" for |psi|^2 or "real" for Re(psi).
+    Output:
+        Frames on the grid, 3D systems projected (density) or cut (real)
+        along z.
+    """
+    for i in range(numberFrames):
+        if i > 0:
+            for k in range(stepsPerFrame):
+                sim.evolve()
+        if quantity == "density":
+            values = sim.densityPsi()
+        else:
+            values = sim.realPsi()
+        if sim.dim == 1:
+            yield values
+        elif quantity == "density":
+            yield sim.planeProjection(values)
+        else:
+            yield sim.planeSlice(values)
+
+
+def colormapTable(name="jet", size=256):
+    """
+    Lookup table of a matplotlib colormap, size <= 256 colours packed as
+    uint32 words with the bytes R, G, B, 0 in memory (ffmpeg's rgb0).
+    """
+    colors = plt.get_cmap(name)(np.linspace(0, 1, size))
+    table = np.round(255*colors).astype(np.uint8)
+    table[:, 3] = 0
+    return table.view(np.uint32).ravel()
+
+
+class FrameRenderer:
+    """
+    Maps frames to images of rgb0 pixels, (height, width, 4) uint8 arrays
+    whose fourth byte is unused. 2D frames [x, y] are coloured with a
+    lookup table, x to the right and y up like imshow with origin='lower',
+    and the cells with a potential are darkened in proportion to it. 1D
+    frames are drawn as a filled curve. Every grid cell takes scale x scale
+    pixels.
+    """
+
+    def __init__(self, vmin, vmax, colormap="jet", potential=None,
+                 height=256, scale=1):
+        """
+        Inputs:
+            vmin, vmax: (float) Values at the ends of the colormap (2D),
+                or of the vertical axis (1D).
+            colormap: (str) Name of a matplotlib colormap.
+            potential: (array) Potential on the grid of the frames, for the
+                shading of 2D frames, e.g. sim.planeSlice(sim.potential).
+            height: (int) Height in pixels of the images of 1D frames.
+            scale: (int) Pixels per grid cell along each axis.
+        """
+        self.vmin = vmin
+        self.vmax = vmax
+        self.table = colormapTable(colormap)
+        self.height = height
+        self.scale = scale
+        self.shaded = None
+        if potential is not None:
+            potential = np.asarray(potential, dtype=float)
+            if potential.ndim == 2:
+                # Pixels with a potential, which is usually a small part of
+                # the image, and their brightness in units of 1/256
+                top = np.abs(potential).max() or 1
+                shade = self._upscale(1 - np.abs(potential).T[::-1]/top)
+                self.shaded = np.nonzero(shade.ravel() < 1)[0]
+                self.shade = np.round(256*shade.ravel()[self.shaded])
+                self.shade = self.shade.astype(np.uint16)[:, None]
+
+    def _upscale(self, image):
+        if self.scale > 1:
+            return image.repeat(self.scale, axis=0).repeat(self.scale,
+                                                           axis=1)
+        return image
+
+    def __call__(self, frame):
+        """Image of a frame."""
+        frame = np.asarray(frame)
+        if frame.ndim == 1:
+            image = self._upscale(self._curve(frame))
+        else:
+            image = self._colour(frame)
+        return image.view(np.uint8).reshape(image.shape + (4,))
+
+    def _colour(self, frame):
+        size = len(self.table)
+        # Same bins as matplotlib's colormaps
+        levels = (frame.T[::-1] - self.vmin)*(size/(self.vmax - self.vmin))
+        # The indices fit in one byte, and are upscaled before the lookup,
+        # which is cheaper than upscaling the image
+        indices = np.clip(levels, 0, size - 1).astype(np.uint8)
+        image = np.take(self.table, self._upscale(indices))
+        if self.shaded is not None:
+            pixels = image.view(np.uint8).reshape(-1, 4)
+            pixels[self.shaded] = (pixels[self.shaded]*self.shade) >> 8
+        return image
+
+    def _curve(self, frame):
+        levels = (frame - self.vmin)/(self.vmax - self.vmin)
+        tops = np.round((1 - np.clip(levels, 0, 1))*(self.height - 1))
+        rows = np.arange(self.height)[:, None]
+        white = np.array([255, 255, 255, 0], np.uint8).view(np.uint32)
+        image = np.where(rows >= tops[None, :],
+                         self.table[len(self.table)//5], white[0])
+        return image.astype(np.uint32)
+
+
+# Renderer of the worker processes, set by _initWorker
+_renderer = None
+
+
+def _render(frame):
+    """Worker: render one frame to raw bytes."""
+    return _renderer(frame).tobytes()
+
+
+def _initWorker(renderer):
+    global _renderer
+    _renderer = renderer
+
+
+def writeMovie(frames, filename, fps=60, colormap="jet", vmin=None,
+               vmax=None, potential=None, scale=1, workers=None,
+               ffmpeg="ffmpeg", bitrate="3000k"):
+    """
+    Encode frames into a movie with ffmpeg, rendering them in a pool of
+    worker processes while ffmpeg encodes and the frames are produced.
+    Inputs:
+        frames: (iterable) Frames of the same shape, e.g. from
+            simulationFrames or a recorder.Trajectory of densities (2D
+            trajectories [x, y], or a slice of traj[i] for 3D).
+        filename: (str) Output file, its extension selects the container.
+        fps: (int) Frames per second.
+        colormap: (str) Name of a matplotlib colormap.
+        vmin, vmax: (float) Range of the colormap, by default from 0 (or
+            -vmax if the first frame has negative values) to the largest
+            value of the first frame.
+        potential: (array) Potential shaded over 2D frames.
+        scale: (int) Pixels per grid cell.
+        workers: (int) Number of rendering processes, by default the
+            number of cores. With 1 the frames are rendered here.
+        ffmpeg: (str) The ffmpeg executable.
+        bitrate: (str) Bitrate of the video.
+    Output:
+        (int) Number of frames written.
+    """
+    frames = iter(frames)
+    first = np.asarray(next(frames))
+    if vmax is None:
+        vmax = np.abs(first).max() or 1
+    if vmin is None:
+        vmin = -vmax if first.min() < 0 else 0
+    renderer = FrameRenderer(vmin, vmax, colormap, potential, scale=scale)
+    height, width = renderer(first).shape[:2]
+
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo',
+               '-pix_fmt', 'rgb0', '-s', '%dx%d' % (width, height),
+               '-r', str(fps), '-i', '-', '-an', '-c:v', 'libx264',
+               '-pix_fmt', 'yuv420p', '-b:v', bitrate,
+               # Even sizes, needed by yuv420p
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', filename]
+    encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def allFrames():
+        yield first
+        yield from frames
+
+    count = 0
+    try:
+        if workers == 1:
+            for frame in allFrames():
+                encoder.stdin.write(renderer(frame).tobytes())
+                count += 1
+        else:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(workers, _initWorker, (renderer,)) as pool:
+                # imap keeps the order of the frames
+                for image in pool.imap(_render, allFrames(), chunksize=4):
+                    encoder.stdin.write(image)
+                    count += 1
+    finally:
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError("ffmpeg failed, exit code %d." %
+                               encoder.returncode)
+    return count
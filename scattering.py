@@ -29,18 +29,15 @@ def scattering(x, y):
     '''1/r^2 Dispersive force around a defined center '''
     center = [0.5, 1.]
     alpha = 10
-    r = np.linalg.norm([x - center[0], y - center[1]])
+    r = np.hypot(x - center[0], y - center[1])
     return alpha/r
 
 
 def scatteringVis(x, y):
     '''An exaggereted potential function to make it more visisble'''
     center = [0.5, 1.]
-    r = np.linalg.norm([x - center[0], y - center[1]])
-    if r < .05:
-        return 1
-    else:
-        return 0
+    r = np.hypot(x - center[0], y - center[1])
+    return np.where(r < .05, 1, 0)
 
 
 # Create the simulation for the system
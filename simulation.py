@@ -2,14 +2,35 @@
 simulation.py
 Class that performs the evolution of the system.
 
+The potential is evaluated once and kept in self.potential, which stays
+real and in double precision: the absorbing layer -iW is kept in
+self.absorber and only added to the operators. Time dependent potentials
+are evaluated at the middle of every step, and only the diagonal of the
+operators is updated, as chosen by self.potentialUpdate ("split" or
+"exact").
+
+On a non-uniform grid self.psi holds sqrt(w) psi, w being the cell sizes
+in self.weights, so that normPsi still gives the probability of every
+point and sums to 1, while realPsi and densityPsi give the values of psi.
+Non-uniform grids run on the CN and Krylov engines.
+
+In single precision (dtype=np.complex64) the rounding errors make the
+norm drift, see normDrift. The sparse LU factors of the CN matrix fill in
+with subnormal numbers, so that solve is smaller but not faster.
+
 created on: 24-04-2017.
 @author: eduardo
 
 """
+import collections
 import numpy as np
-import scipy.sparse as sp
-import scipy.sparse.linalg as sla
 import matrix
+import solvers
+import propagators
+import observables
+import spectral
+import storage
+import decomposition
 
 
 class Simulation:
@@ -18,78 +39,399 @@ class Simulation:
     It takes a function for the potential and generates the discretised
 
     Hamiltonian. The evoluion of the system is made using Crank-Nicholson.
+    In 2D and 3D the alternating direction implicit method can be used
+    instead, with engine="ADI", and without boundaries the split-step Fourier
+    method on a periodic grid, with engine="FFT". engine="Krylov" applies
+    the exponential of H with the Krylov subspace method, which only needs
+    matrix-vector products and allows large time steps.
     """
 
     def __init__(self, dim, potentialFunc, dirichletBC, numberPoints,
-                 startPoint, domainLength, dt):
-        """Intilializes the object."""
+                 startPoint, domainLength, dt, engine="CN",
+                 numberStates=None, matrixFree=False, timeDependent=False,
+                 solver="auto", solverOptions=None, order=2,
+                 absorberWidth=0, absorberStrength=500, grid=None,
+                 stencilOrder=2, cache=None, dtype=np.complex128,
+                 profiler=None, workers=None):
+        """
+        Intilializes the object.
+        Inputs:
+            dim: (int) Dimension, 1, 2 or 3.
+            potentialFunc: The potential, a function of whole coordinate
+                arrays or of scalar coordinates, or an array of its values
+                on the grid. Time dependent ones take the time last.
+            dirichletBC: (Boolean) Whether psi vanishes on the boundary.
+            numberPoints, startPoint, domainLength: (int, float or list,
+                float) The uniform grid.
+            dt: (float) Time step.
+            engine: (str) "CN", "ADI", "FFT" or "Krylov".
+            numberStates: (int) Number of wavefunctions evolved together,
+                psi is then a (numberStates, grid) block.
+            matrixFree: (Boolean) Compute B psi with the stencil instead
+                of storing B.
+            timeDependent: (Boolean) Whether the potential depends on the
+                time, see _updatePotential.
+            solver, solverOptions: (str, dict) Backend of the CN systems
+                and its options, see solvers.makeSolver.
+            order: (int) 2, 4 or 6, order of the CN engine in time, see
+                propagators.Pade. Time dependent potentials need 2 or 4
+                (the Magnus step, see _magnusStep).
+            absorberWidth, absorberStrength: (float) Absorbing layer along
+                the edges, see matrix.absorbingLayer.
+            grid: (numpy vector or list of them) Non-uniform coordinates,
+                replacing numberPoints, startPoint and domainLength.
+            stencilOrder: (int) 2, 4 or 6, order of the Laplacian.
+            cache: (storage.OperatorCache) Cache of the operators.
+            dtype: np.complex128 or np.complex64, precision of psi and of
+                the operators.
+            profiler: (profiling.Profiler) Profiler of the run.
+            workers: (int) Number of processes of the ADI engine in 2D,
+                see decomposition.py.
+        """
+        if np.dtype(dtype) not in (np.complex64, np.complex128):
+            raise ValueError("dtype must be complex64 or complex128.")
+        self.dtype = np.dtype(dtype)
         self.dim = dim
         self.numberPoints = numberPoints
         self.startPoint = startPoint
         self.domainLength = domainLength
         self.time = 0
         self.dt = dt
+        self.engine = engine
+        self.numberStates = numberStates
+        self.matrixFree = matrixFree
+        self.timeDependent = timeDependent
+        self.order = order
+        self.stencilOrder = stencilOrder
+        # Iterations of the last iterative solve, and the limit before
+        # refactorising an outdated factorisation
+        self.iterations = 0
+        self.refactorIterations = 10
+        self.solver = solver
+        self.solverOptions = solverOptions or {}
+        self.iterationCounts = []
+        self.potentialUpdate = "split"
+        # Functions called as callback(self) after every step, e.g. the
+        # recorder.Recorder
+        self.callbacks = []
+        # spectral.Eigenbasis of the last projectEigenstates
+        self.eigenbasis = None
+        self.cache = cache
+        self.profiler = None
+        if profiler is not None:
+            profiler.attach(self)
 
         self.sign = -1
         if dirichletBC:
             self.sign = 1
+        if stencilOrder != 2 and engine == "ADI":
+            raise ValueError("The ADI engine needs stencilOrder = 2.")
+        if order != 2 and engine != "CN":
+            raise ValueError("Only the CN engine has order = 4 or 6.")
+        if workers is not None and engine != "ADI":
+            raise ValueError("Only the ADI engine runs on several workers.")
+
+        # Coordinates of a non-uniform grid and the size of every cell
+        self.axes = None
+        self.weights = None
+        if grid is not None:
+            self._setGrid(grid, engine)
 
         self.allPoints = self.numberPoints + self.sign
-        H = self._getHamiltonian(np.vectorize(potentialFunc))
-        Id = sp.identity((self.numberPoints + self.sign)**self.dim)
 
-        # Define the matrices used in CN evolution
-        self.A = (Id + 1j*H*self.dt/2)
-        self.B = (Id - 1j*H*self.dt/2)
+        self.potentialFunc = potentialFunc
+        if timeDependent:
+            self.potential = self._evaluate(potentialFunc, self.time)
+        else:
+            self.potential = self._evaluate(potentialFunc)
+
+        self.absorber = None
+        if absorberWidth > 0:
+            starts = np.atleast_1d(self.startPoint)
+            lengths = self.domainLength
+            if self.axes is not None:
+                # The axes of a non-uniform grid can differ in extent
+                lengths = [x[-1] - x[0] for x in self.axes]
+            self.absorber = self._evaluate(
+                lambda *x: matrix.absorbingLayer(x, starts, lengths,
+                                                 absorberWidth,
+                                                 absorberStrength))
+        potential = self._operatorPotential(self.potential)
+        # Identifies the system, in the cache and in the checkpoints
+        self._systemKey = storage.operatorKey(self, potential)
+
+        # Matrix-free Hamiltonian, also usable as a scipy LinearOperator
+        self.hamiltonian = matrix.StencilHamiltonian(potential,
+                                                     dirichletBC,
+                                                     self.numberPoints,
+                                                     self.domainLength,
+                                                     self.axes, stencilOrder)
+
+        # Potential and Hamiltonian held by the stepping operators, which
+        # can lag behind a time dependent potential (see _updatePotential)
+        self._stepPotential = self.potential
+        self._stepHamiltonian = self.hamiltonian
+        if timeDependent:
+            self._stepHamiltonian = matrix.StencilHamiltonian(
+                potential, dirichletBC, self.numberPoints, self.domainLength,
+                self.axes, stencilOrder)
+
+        self._propagator = None
+        if engine == "CN" and order != 2:
+            if timeDependent and order != 4:
+                raise ValueError("Time dependent potentials need order 4.")
+            self.A = self.B = None
+            # The Magnus step is made of two half steps
+            step = self.dt/2 if timeDependent else self.dt
+            self._propagator = propagators.Pade(
+                self._cachedHamiltonian(potential), step, order, solver,
+                solverOptions)
+        elif engine == "CN":
+            H = self._cachedHamiltonian(potential)
+            self._diagonal = diagonal = matrix.diagonalIndex(H)
+
+            # Define the matrices used in CN evolution, Id +- i H dt/2,
+            # in the CSC format used by the factorisation.
+            A = H*(0.5j*self.dt)
+            A.data[diagonal] += 1
+            self.A = A
+            # The factorisation of A can be shared through the cache
+            self._operatorKey = self._systemKey
+            if matrixFree:
+                self.B = None
+            else:
+                B = H*(-0.5j*self.dt)
+                B.data[diagonal] += 1
+                self.B = B
+        elif engine == "ADI":
+            if self.dim not in (2, 3):
+                raise ValueError("The ADI engine needs dim = 2 or 3.")
+            self.A = self.B = None
+            if workers is not None:
+                self._propagator = decomposition.ParallelADI(
+                    potential, dirichletBC, self.numberPoints,
+                    self.domainLength, self.dt, workers)
+            else:
+                self._propagator = propagators.ADI(potential, dirichletBC,
+                                                   self.numberPoints,
+                                                   self.domainLength,
+                                                   self.dt)
+        elif engine == "Krylov":
+            self.A = self.B = None
+            # The time dependent updates of _updatePotential are made on
+            # the stencil Hamiltonian, which is used directly
+            if matrixFree or timeDependent:
+                H = self._stepHamiltonian
+            else:
+                H = self._cachedHamiltonian(potential).tocsr()
+            self._propagator = propagators.KrylovExponential(
+                H, self.dt, hermitian=self.absorber is None,
+                **self.solverOptions)
+        elif engine == "FFT":
+            if dirichletBC:
+                raise ValueError("The FFT engine needs a periodic grid, "
+                                 "without Dirichlet boundaries.")
+            self.A = self.B = None
+            self._propagator = propagators.SplitOperator(potential,
+                                                         self.numberPoints,
+                                                         self.domainLength,
+                                                         self.dt)
+        else:
+            raise ValueError("Unknown engine: " + str(engine))
+
+        if self.profiler is not None:
+            self.profiler.attachPropagator(self._propagator)
 
         # Initialize wavefunction
-        self.psi = np.zeros(self.allPoints**self.dim, dtype=np.complex128)
-        self.pulse = np.zeros(self.allPoints**self.dim, dtype=np.complex128)
+        shape = (self.allPoints**self.dim,)
+        if numberStates is not None:
+            shape = (numberStates,) + shape
+        self.psi = np.zeros(shape, dtype=self.dtype)
+        self.pulse = np.zeros(shape, dtype=self.dtype)
+
+    def _setGrid(self, grid, engine):
+        """Set up a non-uniform grid, see __init__."""
+        if engine not in ("CN", "Krylov"):
+            raise ValueError("Non-uniform grids need the CN or Krylov "
+                             "engine.")
+        if self.dim == 1:
+            axes = [np.asarray(grid, dtype=float)]
+        else:
+            axes = [np.asarray(x, dtype=float) for x in grid]
+        if len(axes) != self.dim or len(set(map(len, axes))) != 1:
+            raise ValueError("The grid needs dim axes with the same number "
+                             "of points.")
+
+        self.axes = axes
+        self.numberPoints = len(axes[0]) - self.sign
+        # Length of the first axis, the others can differ
+        self.domainLength = axes[0][-1] - axes[0][0]
+        self.startPoint = [x[0] for x in axes]
+        if self.dim == 1:
+            self.startPoint = axes[0][0]
+        weights = [matrix.axisStencil(x)[0] for x in axes]
+        self.weights = np.prod(np.meshgrid(*weights, indexing='ij'),
+                               axis=0).ravel()
 
     def _getHamiltonian(self, potentialFunc):
         """
         Generate the Hamiltonian matrix using the functions
         defined in "matrix.py".
         """
+        if self.axes is not None:
+            return matrix.AGraded(self.axes, potentialFunc, self.sign == 1)
         if self.dim == 1:
             if self.sign == -1:
                 return matrix.A1D(self.numberPoints, potentialFunc,
-                                  self.startPoint, self.domainLength)
+                                  self.startPoint, self.domainLength,
+                                  stencilOrder=self.stencilOrder)
             else:
                 return matrix.A1Dfull(self.numberPoints, potentialFunc,
-                                      self.startPoint, self.domainLength)
+                                      self.startPoint, self.domainLength,
+                                      stencilOrder=self.stencilOrder)
 
         if self.dim == 2:
             if self.sign == -1:
                 return matrix.A2D(self.numberPoints, potentialFunc,
-                                  self.startPoint, self.domainLength)
+                                  self.startPoint, self.domainLength,
+                                  stencilOrder=self.stencilOrder)
             else:
                 return matrix.A2Dfull(self.numberPoints, potentialFunc,
-                                      self.startPoint, self.domainLength)
+                                      self.startPoint, self.domainLength,
+                                      stencilOrder=self.stencilOrder)
+
+        if self.dim == 3:
+            if self.sign == -1:
+                return matrix.A3D(self.numberPoints, potentialFunc,
+                                  self.startPoint, self.domainLength,
+                                  stencilOrder=self.stencilOrder)
+            else:
+                return matrix.A3Dfull(self.numberPoints, potentialFunc,
+                                      self.startPoint, self.domainLength,
+                                      stencilOrder=self.stencilOrder)
+
+    def _cachedHamiltonian(self, potential):
+        """The Hamiltonian matrix, from self.cache if it is there."""
+        if self.cache is None:
+            return self._getHamiltonian(potential)
+        H = self.cache.hamiltonian(self._systemKey)
+        if H is None:
+            H = self._getHamiltonian(potential)
+            self.cache.storeHamiltonian(self._systemKey, H)
+        return H
+
+    def getPotential(self, potentialFunc=None):
+        """
+        Return a potential evaluated on the grid, as an array with one axis
+        per dimension, indexed as [x, y(, z)]. Without argument, or with the
+        potential of the simulation, the cached values are returned.
+        """
+        if potentialFunc is None or potentialFunc is self.potentialFunc:
+            return self.potential
+        return self._evaluate(potentialFunc)
+
+    def _evaluate(self, potentialFunc, *args):
+        """
+        Evaluate a potential on the grid, passing the extra args (e.g. the
+        time) after the coordinates.
+        """
+        if self.dim == 1:
+            return matrix.evaluatePotential(potentialFunc, self.domain(),
+                                            *args)
+        axes = [np.ravel(axis) for axis in self.domain()]
+        return matrix.evaluatePotential(potentialFunc,
+                                        *np.meshgrid(*axes, indexing='ij'),
+                                        *args)
 
-    def setPsiPulse(self, pulse, energy, center, vel=1, width=.2):
+    def _operatorPotential(self, v):
+        """
+        The potential used by the operators, V - iW with an absorber, in
+        the precision of psi, which sets that of the operators.
+        """
+        if self.absorber is not None:
+            v = v - 1j*self.absorber
+        if self.dtype == np.complex64:
+            v = v.astype(np.float32 if np.isrealobj(v) else np.complex64)
+        return v
+
+    def _updatePotential(self, t):
+        """
+        Evaluate a time dependent potential at time t and prepare the
+        operators of the next step. Only the diagonal of H changes, so
+        nothing is rebuilt. With potentialUpdate:
+            "split": the operators keep the initial potential V0 and the
+                step is exp(-i dV dt/2) U0 exp(-i dV dt/2), dV = V - V0,
+                which costs the same as a static step.
+            "exact": the diagonals of A and B (or of the ADI systems) are
+                updated in place. The CN factorisation is kept and used
+                as a preconditioner until a solve needs more than
+                refactorIterations iterations (tridiagonal matrices are
+                refactorised every step, which is O(N)).
+        The FFT engine always updates its potential phase, which is exact.
+        """
+        # matrix.A1Dfull has no potential on the boundary points, hence
+        # the 1D Dirichlet ends are left out of the updates below
+        v = self._evaluate(self.potentialFunc, t)
+        self.potential = v
+        self.hamiltonian.setPotential(self._operatorPotential(v))
+
+        if self.engine == "FFT":
+            self._propagator.setPotential(self._operatorPotential(v))
+            return
+        if self.potentialUpdate == "split":
+            drive = (v - self._stepPotential).ravel()
+            if self.dim == 1 and self.sign == 1:
+                drive[[0, -1]] = 0
+            self._driveFactor = np.exp(-0.5j*self.dt*drive).astype(
+                self.dtype)
+            return
+
+        dv = (v - self._stepPotential).ravel()
+        self._stepPotential = v
+        self._stepHamiltonian.setPotential(self._operatorPotential(v))
+        if self.engine == "Krylov":
+            return
+        if self.engine != "CN":
+            self._propagator.setPotential(self._operatorPotential(v))
+            return
+
+        if self.dim == 1 and self.sign == 1:
+            dv[[0, -1]] = 0
+        self.A.data[self._diagonal] += 0.5j*self.dt*dv
+        if self.B is not None:
+            self.B.data[self._diagonal] -= 0.5j*self.dt*dv
+
+        if isinstance(self._solver, solvers.TridiagonalSolver):
+            self._solver = None
+        else:
+            self._outdated = True
+
+    def setPsiPulse(self, pulse, energy, center, vel=1, width=.2,
+                    state=None):
         """
         Generate the initial wavefunction as a Gaussian wavepacket. By default
         it moves to the right.
         Inputs:
             pulse:  (string) plane wave or circular pulse
             energy: (int/float) The waves energy/size.
-            center: (float or tuple) Either x or [x, y], for a guassian line
-                    profile or 2D gaussian, respectively.
-            vel:    (float or tuple) Velocity v_x or [v_x, v_y], the Velocity
-                    of the pulse
+            center: (float or tuple) Either x, [x, y] or [x, y, z], for a
+                    guassian line profile, 2D or 3D gaussian, respectively.
+            vel:    (float or tuple) Velocity v_x, [v_x, v_y] or
+                    [v_x, v_y, v_z], the Velocity of the pulse
             width:  Standard deviation of the Gaussian wave pulse.
+            state:  (int) In batched simulations, the state that gets the
+                    pulse. By default all of them.
         Output:
             Sets psi of the object to have the desired wave form.
         """
         if self.dim == 1:
             if pulse == "plane":
                 x = self.domain()
-                self.pulse = np.exp(1j * vel * np.sqrt(energy) * x) * \
+                newPulse = np.exp(1j * vel * np.sqrt(energy) * x) * \
                                     np.exp(-0.5 * (x-center)**2 / width**2)
-                norm_Const = np.linalg.norm(self.pulse)
+                norm_Const = np.linalg.norm(newPulse)
             else:
-                self.pulse = np.zeros(self.allPoints)
+                newPulse = np.zeros(self.allPoints)
                 # Otherwise would divide by zero
                 norm_Const = 1
         elif self.dim == 2:
@@ -100,54 +442,378 @@ class Simulation:
                               np.exp(-0.5 * (x-center)**2 / width**2)
 
                 y_const = np.ones(self.allPoints)
-                self.pulse = np.kron(psix, y_const.flatten())
-                norm_Const = np.linalg.norm(self.pulse)
+                newPulse = np.kron(psix, y_const.flatten())
+                norm_Const = np.linalg.norm(newPulse)
             elif pulse == "circular":
                 psix = np.exp(1j * vel[0] * np.sqrt(energy) * x) * \
                               np.exp(-0.5 * (x-center[0])**2 / width**2)
                 psiy = np.exp(1j * vel[1] * np.sqrt(energy) * y) * \
                               np.exp(-0.5 * (y-center[1])**2 / width**2)
 
-                self.pulse = np.kron(psix, psiy.flatten())
-                norm_Const = np.linalg.norm(self.pulse)
+                newPulse = np.kron(psix, psiy.flatten())
+                norm_Const = np.linalg.norm(newPulse)
             else:
-                self.pulse = np.zeros(self.allPoints**2)
+                newPulse = np.zeros(self.allPoints**2)
                 # Otherwise would divide by zero
                 norm_Const = 1
+        elif self.dim == 3:
+            [x, y, z] = [np.ravel(axis) for axis in self.domain()]
 
-        self.psi += self.pulse/norm_Const
+            if pulse == "plane":
+                psix = np.exp(1j * vel * np.sqrt(energy) * x) * \
+                              np.exp(-0.5 * (x-center)**2 / width**2)
+
+                yz_const = np.ones(self.allPoints**2)
+                newPulse = np.kron(psix, yz_const)
+                norm_Const = np.linalg.norm(newPulse)
+            elif pulse == "circular":
+                psix = np.exp(1j * vel[0] * np.sqrt(energy) * x) * \
+                              np.exp(-0.5 * (x-center[0])**2 / width**2)
+                psiy = np.exp(1j * vel[1] * np.sqrt(energy) * y) * \
+                              np.exp(-0.5 * (y-center[1])**2 / width**2)
+                psiz = np.exp(1j * vel[2] * np.sqrt(energy) * z) * \
+                              np.exp(-0.5 * (z-center[2])**2 / width**2)
+
+                newPulse = np.kron(np.kron(psix, psiy), psiz)
+                norm_Const = np.linalg.norm(newPulse)
+            else:
+                newPulse = np.zeros(self.allPoints**3)
+                # Otherwise would divide by zero
+                norm_Const = 1
+
+        if self.weights is not None:
+            # psi is stored as sqrt(w) psi on non-uniform grids
+            newPulse = newPulse*np.sqrt(self.weights)
+            norm_Const = np.linalg.norm(newPulse) or 1
+
+        if self.numberStates is None:
+            self.pulse = newPulse
+            self.psi += newPulse/norm_Const
+        else:
+            if state is None:
+                state = slice(None)
+            self.pulse[state] = newPulse
+            self.psi[state] += newPulse/norm_Const
 
     def normPsi(self):
-        """Return the norm of the wave function."""
+        """Return the norm of the wave function (of every state if batched)."""
         return np.absolute(self.psi)**2
 
     def realPsi(self):
-        """Return the real part of the wavefunction."""
+        """Return the real part of the wavefunction (of every state)."""
+        if self.weights is not None:
+            return np.real(self.psi)/np.sqrt(self.weights)
         return np.real(self.psi)
 
+    def densityPsi(self):
+        """
+        Return |psi|^2 at every point, in the units of realPsi. It is
+        normPsi on uniform grids and normPsi/w on non-uniform ones.
+        """
+        if self.weights is not None:
+            return self.normPsi()/self.weights
+        return self.normPsi()
+
+    @property
+    def A(self):
+        """Matrix on the implicit side of the Crank-Nicholson step."""
+        return self._A
+
+    @A.setter
+    def A(self, A):
+        # A new matrix invalidates the cached factorisation
+        self._A = A
+        self._solver = None
+        self._outdated = False
+        self._operatorKey = None
+
+    def _solve(self, rhs):
+        """
+        Solve A x = rhs. The solver of A is made on the first call and
+        reused afterwards. If A has been changed in place since, an old
+        factorisation preconditions an iterative solve, while the Krylov
+        backends keep working on the updated A.
+        """
+        # Factorisations of the initial A are shared through the cache,
+        # time dependent potentials change A in place
+        shared = self.cache is not None and self._operatorKey is not None \
+            and not self.timeDependent
+        if self._solver is None and shared:
+            self._solver = self.cache.solver(self._operatorKey)
+        if self._solver is None:
+            self._solver = solvers.makeSolver(self.A, self.solver,
+                                              **self.solverOptions)
+            self._outdated = False
+            factorised = (solvers.LUSolver, solvers.TridiagonalSolver)
+            if shared and isinstance(self._solver, factorised):
+                self.cache.storeSolver(self._operatorKey, self._solver)
+        if isinstance(self._solver, solvers.DirectSolver):
+            return self._solver.solve(rhs)
+        if isinstance(self._solver, solvers.KrylovSolver):
+            x = self._solver.solve(rhs)
+            self.iterations = self._solver.iterations
+            self.iterationCounts.append(self.iterations)
+            return x
+        if not self._outdated:
+            return self._solver.solve(rhs)
+
+        x, self.iterations = solvers.preconditionedSolve(self.A, rhs,
+                                                         self._solver)
+        self.iterationCounts.append(self.iterations)
+        if self.iterations > self.refactorIterations:
+            self._solver = None
+        return x
+
+    def _step(self, psi, t):
+        """
+        Return psi evolved by one time step, starting at time t, with the
+        selected engine. A (K, grid) block is evolved with a single
+        multi-vector solve.
+        """
+        if self.timeDependent and isinstance(self._propagator,
+                                             propagators.Pade):
+            psi = self._magnusStep(psi, t)
+        elif self.timeDependent:
+            self._updatePotential(t + self.dt/2)
+            if self.engine != "FFT" and self.potentialUpdate == "split":
+                psi = self._driveFactor*psi
+                psi = self._driveFactor*self._staticStep(psi)
+            else:
+                psi = self._staticStep(psi)
+        else:
+            psi = self._staticStep(psi)
+        if self.dtype == np.complex64:
+            self._flushSubnormal(psi)
+        return psi
+
+    def _flushSubnormal(self, psi):
+        """
+        Set the float32 values below the smallest normal number to zero.
+        The tails of the wave packets underflow to such subnormal values,
+        on which the single precision solves run about twice slower.
+        """
+        tiny = np.finfo(np.float32).tiny
+        for part in (psi.real, psi.imag):
+            part[np.abs(part) < tiny] = 0
+
+    def _staticStep(self, psi):
+        """One step of the engine with its current operators."""
+        if self._propagator is None:
+            return self._solve(self._explicitStep(psi.T)).T
+        psi = self._propagator.step(psi)
+        if self.engine == "Krylov":
+            self.iterations = self._propagator.iterations
+        return psi
+
+    def _magnusStep(self, psi, t):
+        """
+        Fourth order commutator free Magnus step of a time dependent
+        potential,
+            psi' = exp(-i dt (a1 H1 + a2 H2)) exp(-i dt (a2 H1 + a1 H2)) psi
+        with Hj = H(t + cj dt), c = 1/2 -+ sqrt(3)/6 and
+        a = (3 -+ 2 sqrt(3))/12. As a1 + a2 = 1/2 every exponential is a
+        half step of the Pade propagator with the potential
+        2 (a2 V1 + a1 V2), resp. 2 (a1 V1 + a2 V2), which only changes the
+        diagonal of its stage matrices.
+        """
+        r = np.sqrt(3)
+        a1, a2 = (3 - 2*r)/12, (3 + 2*r)/12
+        v1 = self._evaluate(self.potentialFunc, t + (0.5 - r/6)*self.dt)
+        v2 = self._evaluate(self.potentialFunc, t + (0.5 + r/6)*self.dt)
+        self.potential = (v1 + v2)/2
+        self.hamiltonian.setPotential(self._operatorPotential(self.potential))
+
+        for v in (2*(a2*v1 + a1*v2), 2*(a1*v1 + a2*v2)):
+            dv = (v - self._stepPotential).ravel()
+            if self.dim == 1 and self.sign == 1:
+                dv[[0, -1]] = 0
+            self._stepPotential = v
+            self._propagator.shiftPotential(dv)
+            psi = self._propagator.step(psi)
+        self.iterations = self._propagator.iterations
+        return psi
+
+    def prepare(self):
+        """
+        Factorise the operators now instead of in the first step, e.g.
+        before forking processes that share them (see sweep.py).
+        """
+        if not self.timeDependent:
+            self._staticStep(np.zeros_like(self.psi))
+
+    def _explicitStep(self, psi):
+        """Return B psi = psi - i dt/2 H psi, the explicit half of CN."""
+        if self.B is None:
+            return psi - 0.5j*self.dt*self._stepHamiltonian.dot(psi)
+        return self.B.dot(psi)
+
     # Time evolutions
     def evolve(self):
-        """Evolve the system using Crank-Nicholson."""
+        """Evolve the system one time step."""
+        self.psi = self._step(self.psi, self.time)
         self.time += self.dt
-        self.psi = sp.linalg.spsolve(self.A, self.B.dot(self.psi),
-                                     permc_spec='NATURAL')
+        self._stepDone()
 
     def evolvePulsed(self, freq):
-        """Evolve the system using Crank-Nicholson."""
+        """Evolve the system, adding the pulse every freq steps."""
         self.time += 1
         if self.time % (freq) == 0:
             self.psi += self.pulse
-            self.psi = self.psi/np.linalg.norm(self.psi)
-        self.psi = sp.linalg.spsolve(self.A, self.B.dot(self.psi),
-                                     permc_spec='NATURAL')
+            self.psi = self.psi/np.linalg.norm(self.psi, axis=-1,
+                                               keepdims=True)
+        # Here time counts the steps
+        self.psi = self._step(self.psi, (self.time - 1)*self.dt)
+        self._stepDone()
+
+    def _stepDone(self):
+        """Call the registered callbacks after a step."""
+        for callback in self.callbacks:
+            callback(self)
+
+    def evolveAdaptive(self, duration, tol=1e-4, maxStep=None):
+        """
+        Evolve the system for the given time, choosing the time step by
+        step doubling: every step of size dt is compared with two steps of
+        dt/2, the step is accepted (keeping the two half steps) if they
+        differ less than tol, and dt is halved or doubled accordingly. The
+        steps are powers of 2 times self.dt, and the Pade propagators of
+        the last few sizes are cached. The shorter last step of the
+        duration is not cached. Only for time independent potentials.
+        Inputs:
+            duration: (float) Time to evolve.
+            tol: (float) Largest difference between the two estimates of
+                psi (norm 1) in a step.
+            maxStep: (float) Largest time step, by default no limit.
+        Output:
+            (list) The accepted time steps.
+        """
+        if self.timeDependent or self.engine != "CN":
+            raise ValueError("Adaptive steps need the CN engine and a time "
+                             "independent potential.")
+        if not hasattr(self, '_adaptive'):
+            # Propagators of the last step sizes, by their power of 2
+            self._adaptive = collections.OrderedDict()
+            self._adaptiveHamiltonian = self._getHamiltonian(
+                self._operatorPotential(self.potential))
+        order = self.order
+
+        def propagator(dt):
+            power = np.log2(dt/self.dt)
+            if power != round(power):
+                return propagators.Pade(self._adaptiveHamiltonian, dt, order,
+                                        self.solver, self.solverOptions)
+            power = int(power)
+            if power not in self._adaptive:
+                self._adaptive[power] = propagators.Pade(
+                    self._adaptiveHamiltonian, dt, order, self.solver,
+                    self.solverOptions)
+                # A step and its half, before and after a change of dt
+                if len(self._adaptive) > 4:
+                    self._adaptive.popitem(last=False)
+            self._adaptive.move_to_end(power)
+            return self._adaptive[power]
+
+        end = self.time + duration
+        dt = getattr(self, '_adaptiveStep', self.dt)
+        steps = []
+        while end - self.time > 1e-12*max(1, abs(end)):
+            step = min(dt, end - self.time)
+            whole = propagator(step).step(self.psi)
+            half = propagator(step/2)
+            psi = half.step(half.step(self.psi))
+            error = np.linalg.norm(psi - whole, axis=-1).max()
+
+            if error > tol:
+                dt = dt/2
+                continue
+            self.psi = psi
+            self.time += step
+            steps.append(step)
+            self._stepDone()
+            # The error of a step of order p goes as dt^(p+1)
+            if step == dt and error*2**(order + 1) < tol and \
+                    (maxStep is None or 2*dt <= maxStep):
+                dt = 2*dt
+        self._adaptiveStep = dt
+        return steps
+
+    def projectEigenstates(self, numberEigenstates, sigma=None,
+                           cacheDir=None):
+        """
+        Expand the current psi in eigenstates of the Hamiltonian, see
+        spectral.Eigenbasis. The eigenstates are computed on the first call
+        and reused while numberEigenstates and sigma stay the same. Only for
+        time independent potentials, without absorbing layers.
+        Inputs:
+            numberEigenstates: (int) Number of eigenstates.
+            sigma: (float) Energy around which the eigenstates are taken,
+                by default the lowest states. For a wave packet use about
+                its energy.
+            cacheDir: (str) Directory where the eigenstates are cached,
+                keyed by the Hamiltonian, None to not cache them.
+        Output:
+            residual: (float, or array for a batch) Relative norm of the
+                part of psi outside the basis. If it is not small, more
+                eigenstates are needed.
+        """
+        if self.timeDependent:
+            raise ValueError("The eigenbasis needs a time independent "
+                             "potential.")
+        options = (numberEigenstates, sigma)
+        if self.eigenbasis is None or self._eigenOptions != options:
+            H = self._getHamiltonian(self._operatorPotential(self.potential))
+            self.eigenbasis = spectral.Eigenbasis(H, numberEigenstates, sigma,
+                                                  cacheDir)
+            self._eigenOptions = options
+        return self.eigenbasis.project(self.psi, self.time)
+
+    def psiAt(self, time):
+        """
+        Return psi at a time, or at an array of times (first axis), from
+        the expansion of projectEigenstates. Nothing is stepped and
+        self.psi and self.time do not change.
+        """
+        if self.eigenbasis is None:
+            raise ValueError("Call projectEigenstates first.")
+        return self.eigenbasis.psiAt(time)
+
+    def checkpoint(self, filename):
+        """
+        Save the state of the run, psi, pulse and time, to a .npz file,
+        see storage.Checkpointer. The file is replaced atomically, so it
+        is never left half written.
+        """
+        state = {"psi": self.psi, "pulse": self.pulse, "time": self.time,
+                 "system": self._systemKey}
+        if hasattr(self, '_adaptiveStep'):
+            state["adaptiveStep"] = self._adaptiveStep
+        storage.atomicWrite(filename, lambda f: np.savez(f, **state))
+
+    def restore(self, filename):
+        """
+        Load the state saved by checkpoint. The simulation must be of the
+        same system: grid, potential, dt, engine and solver.
+        """
+        with np.load(filename) as state:
+            if str(state["system"]) != self._systemKey:
+                raise ValueError("The checkpoint is of another system.")
+            self.psi = state["psi"]
+            self.pulse = state["pulse"]
+            self.time = state["time"].item()
+            if "adaptiveStep" in state.files:
+                self._adaptiveStep = state["adaptiveStep"].item()
+
+    def normDrift(self):
+        """
+        Largest deviation of the norm from 1 over the states, due to the
+        rounding errors of the steps (or to the absorbing layers).
+        """
+        return float(np.max(np.abs(np.sum(self.normPsi(), axis=-1,
+                                          dtype=np.float64) - 1)))
 
     def consistencyCheck(self):
         """Check if system is consistent by summing probabilities"""
-        P = np.sum(self.normPsi())
-        if abs(P-1) < .001:
-            return True
-        else:
-            return False
+        return self.normDrift() < .001
 
     def probability(self, time):
         '''
@@ -156,17 +822,23 @@ class Simulation:
         Input:
             time: (int) iterations to run
         Output:
-            P: (vector, length=time) Probability at each time
+            P: (vector, length=time) Probability at each time, with shape
+                (time, K) for a batch of K states.
         '''
-        P = np.zeros(time)
+        norm = observables.Observables(self, time)
         for i in range(time):
             self.evolve()
-            P[i] = np.sum(self.normPsi())
-
-        return P
+        norm.detach()
+        return norm.results["norm"]
 
     def domain(self):
         '''Generates evenly spaced vectors spanning the x and y domains'''
+        if self.axes is not None:
+            # Non-uniform grid, with the same shapes as below
+            if self.dim == 1:
+                return self.axes[0]
+            return [x.reshape((-1,) + (1,)*k)
+                    for k, x in enumerate(self.axes)]
         if self.dim == 1:
             x = np.linspace(self.startPoint,
                             self.startPoint + self.domainLength,
@@ -180,5 +852,47 @@ class Simulation:
                             self.startPoint[1] + self.domainLength,
                             self.allPoints).reshape(-1, 1)
             return [x, y]
+        elif self.dim == 3:
+            x = np.linspace(self.startPoint[0],
+                            self.startPoint[0] + self.domainLength,
+                            self.allPoints)
+            y = np.linspace(self.startPoint[1],
+                            self.startPoint[1] + self.domainLength,
+                            self.allPoints).reshape(-1, 1)
+            z = np.linspace(self.startPoint[2],
+                            self.startPoint[2] + self.domainLength,
+                            self.allPoints).reshape(-1, 1, 1)
+            return [x, y, z]
         else:
-            return 0
+            raise ValueError("Only 1, 2 and 3 dimensions are supported.")
+
+    def planeSlice(self, values, axis=2, index=None):
+        '''
+        Cut a 2D plane out of values on a 3D grid, for plotting.
+        Inputs:
+            values: (array) Values on the grid, e.g. normPsi() or the
+                potential.
+            axis: (int) Axis perpendicular to the plane, 2 for z.
+            index: (int) Position of the plane along the axis, by default
+                the middle of the domain.
+        Output:
+            (2D array) Indexed by the two remaining axes, e.g. [x, y]. 2D
+                systems return their values reshaped to [x, y].
+        '''
+        values = np.reshape(values, (self.allPoints,)*self.dim)
+        if self.dim == 2:
+            return values
+        if index is None:
+            index = self.allPoints//2
+        return np.take(values, index, axis=axis)
+
+    def planeProjection(self, values, axis=2):
+        '''
+        Sum values on a 3D grid along one axis, e.g. to plot the probability
+        density integrated along z. 2D systems return their values reshaped
+        to [x, y].
+        '''
+        values = np.reshape(values, (self.allPoints,)*self.dim)
+        if self.dim == 2:
+            return values
+        return values.sum(axis=axis)
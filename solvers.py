@@ -0,0 +1,298 @@
+"""
+solvers.py
+Linear solvers used in the implicit time evolution. The Crank-Nicholson
+matrix does not change between steps, so it is factorised once and the
+factorisation is reused for every right hand side. For grids too big to
+factorise there are preconditioned Krylov solvers, see makeSolver for the
+available backends.
+
+Created on: 18-10-2026.
+"""
+import warnings
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as sla
+from scipy.linalg import get_lapack_funcs
+
+
+class ConvergenceWarning(RuntimeWarning):
+    """An iterative solve stopped before reaching its tolerance."""
+
+
+def _checkConvergence(info, method):
+    """Warn if the scipy info of an iterative solve reports a failure."""
+    if info > 0:
+        warnings.warn("%s did not converge in %d iterations, the solution "
+                      "is inaccurate." % (method, info), ConvergenceWarning,
+                      stacklevel=3)
+    elif info < 0:
+        warnings.warn("%s broke down (info %d), the solution is "
+                      "inaccurate." % (method, info), ConvergenceWarning,
+                      stacklevel=3)
+
+
+class TridiagonalSolver:
+    """
+    LU factorisation of a tridiagonal matrix (LAPACK gttrf). Every solve
+    (gttrs) costs O(N), for one or several right hand sides. The factors
+    (dl, d, du, du2, ipiv) are plain arrays, so they can be saved and
+    the solver rebuilt with TridiagonalSolver.fromFactors.
+    """
+
+    def __init__(self, lower, diag, upper):
+        """
+        Factorise the matrix.
+        Inputs:
+            lower: (N-1, numpy vector) Subdiagonal.
+            diag:  (N, numpy vector) Main diagonal.
+            upper: (N-1, numpy vector) Superdiagonal.
+        """
+        dtype = np.result_type(lower, diag, upper, np.complex64)
+        lower = np.asarray(lower, dtype=dtype)
+        diag = np.asarray(diag, dtype=dtype)
+        upper = np.asarray(upper, dtype=dtype)
+
+        gttrf, self._gttrs = get_lapack_funcs(('gttrf', 'gttrs'),
+                                              (lower, diag, upper))
+        dl, d, du, du2, ipiv, info = gttrf(lower, diag, upper)
+        if info > 0:
+            raise np.linalg.LinAlgError("Singular tridiagonal matrix.")
+        self.dtype = dtype
+        self.factors = (dl, d, du, du2, ipiv)
+
+    @classmethod
+    def fromFactors(cls, dl, d, du, du2, ipiv):
+        """Solver of a matrix factorised before, from its gttrf factors."""
+        solver = cls.__new__(cls)
+        solver._gttrs, = get_lapack_funcs(('gttrs',), (dl, d, du))
+        solver.dtype = d.dtype
+        solver.factors = (dl, d, du, du2, ipiv)
+        return solver
+
+    def solve(self, b):
+        """Solve A x = b, b can be a vector or an (N, K) block."""
+        x, info = self._gttrs(*self.factors,
+                              np.asarray(b, dtype=self.dtype))
+        return x
+
+
+class LUSolver:
+    """Sparse LU factorisation (SuperLU) of a general matrix."""
+
+    def __init__(self, A):
+        self._lu = sla.splu(sp.csc_matrix(A))
+
+    def solve(self, b):
+        """Solve A x = b, b can be a vector or an (N, K) block."""
+        return self._lu.solve(b)
+
+
+class DirectSolver:
+    """
+    Sparse direct solve (spsolve) of every system, nothing is cached. The
+    matrix is kept by reference, like in KrylovSolver.
+    """
+
+    def __init__(self, A):
+        self.A = A
+
+    def solve(self, b):
+        """Solve A x = b, b can be a vector or an (N, K) block."""
+        x = sla.spsolve(self.A, b)
+        return x.reshape(b.shape)
+
+
+class KrylovSolver:
+    """
+    Iterative solver of A x = b with a scipy Krylov method. The
+    preconditioner is built once, when the solver is made for the matrix.
+    The initial guess of every solve comes from the previous solutions:
+        "previous": x0 = x_n-1, psi barely changes in a time step.
+        "extrapolate": x0 = 2 x_n-1 - x_n-2, linear extrapolation.
+        None: x0 = 0.
+    The matrix is kept by reference, so in-place changes of its values are
+    seen by the following solves (with the preconditioner of the original
+    values). A solve that does not reach tol warns with a
+    ConvergenceWarning, and its scipy info is kept in self.info.
+    """
+
+    methods = {"bicgstab": sla.bicgstab, "cgs": sla.cgs, "gmres": sla.gmres,
+               "lgmres": sla.lgmres, "qmr": sla.qmr}
+
+    def __init__(self, A, method="bicgstab", tol=1e-10, maxiter=None,
+                 preconditioner="ilu", warmStart="extrapolate", dropTol=1e-3,
+                 fillFactor=5):
+        """
+        Build the preconditioner.
+        Inputs:
+            A: (scipy sparse matrix) The matrix of the linear systems.
+            method: (str) "bicgstab", "cgs", "gmres", "lgmres" or "qmr".
+            tol: (float) Relative tolerance of the residual.
+            maxiter: (int) Maximum number of iterations.
+            preconditioner: (str) "ilu" (incomplete LU, spilu), "jacobi"
+                (the inverse of the diagonal) or None.
+            warmStart: (str) "previous", "extrapolate" or None.
+            dropTol, fillFactor: (float) Options of the incomplete LU.
+        """
+        if method not in self.methods:
+            raise ValueError("Unknown Krylov method: " + str(method))
+        if warmStart not in ("previous", "extrapolate", None):
+            raise ValueError("Unknown warm start: " + str(warmStart))
+        self.A = A
+        self.method = method
+        self.tol = tol
+        self.maxiter = maxiter
+        self.warmStart = warmStart
+        # Iterations of the last solve, the largest over the columns, and
+        # the scipy info of its first failed column (0 if all converged)
+        self.iterations = 0
+        self.info = 0
+        self._previous = []
+
+        if preconditioner == "ilu":
+            ilu = sla.spilu(sp.csc_matrix(A), drop_tol=dropTol,
+                            fill_factor=fillFactor)
+            # qmr also applies the adjoint of the preconditioner
+            self.M = sla.LinearOperator(A.shape, matvec=ilu.solve,
+                                        rmatvec=lambda x: ilu.solve(x, "H"),
+                                        dtype=A.dtype)
+        elif preconditioner == "jacobi":
+            inverse = 1/A.diagonal()
+            self.M = sla.LinearOperator(
+                A.shape, matvec=lambda x: inverse*x.ravel(),
+                rmatvec=lambda x: inverse.conj()*x.ravel(), dtype=A.dtype)
+        elif preconditioner is None:
+            self.M = None
+        else:
+            raise ValueError("Unknown preconditioner: " + str(preconditioner))
+
+    def _guess(self, shape):
+        """Initial guess from the previous solutions, if they fit."""
+        previous = [x for x in self._previous if x.shape == shape]
+        if self.warmStart is None or not previous:
+            return None
+        if self.warmStart == "extrapolate" and len(previous) == 2:
+            return 2*previous[-1] - previous[-2]
+        return previous[-1]
+
+    def solve(self, b):
+        """Solve A x = b, b can be a vector or an (N, K) block."""
+        columns = b.reshape(len(b), -1)
+        guess = self._guess(columns.shape)
+        solver = self.methods[self.method]
+        count = [0]
+
+        def callback(xk):
+            count[0] += 1
+
+        options = {"rtol": self.tol, "atol": 0, "callback": callback}
+        if self.method == "qmr":
+            # Preconditioned from the left only
+            if self.M is not None:
+                identity = sla.aslinearoperator(sp.identity(
+                    self.A.shape[0], dtype=self.A.dtype))
+                options.update(M1=self.M, M2=identity)
+        else:
+            options["M"] = self.M
+        if self.method == "gmres":
+            # One call per inner iteration, like the other methods
+            options["callback_type"] = "pr_norm"
+        if self.maxiter is not None:
+            options["maxiter"] = self.maxiter
+
+        x = np.empty(columns.shape, dtype=np.result_type(self.A.dtype, b))
+        self.iterations = 0
+        self.info = 0
+        for k in range(columns.shape[1]):
+            count[0] = 0
+            x0 = None if guess is None else guess[:, k]
+            x[:, k], info = solver(self.A, columns[:, k], x0=x0, **options)
+            self.iterations = max(self.iterations, count[0])
+            if info != 0 and self.info == 0:
+                self.info = info
+                _checkConvergence(info, self.method)
+
+        self._previous = (self._previous + [x])[-2:]
+        return x.reshape(b.shape)
+
+
+def isTridiagonal(A):
+    """Check if the sparse matrix A only has entries on the 3 central bands."""
+    A = A.tocoo()
+    if A.nnz == 0:
+        return True
+    return np.abs(A.row - A.col).max() <= 1
+
+
+def factorize(A):
+    """
+    Factorise the matrix A, choosing the cheapest method for its structure.
+    Input:
+        A: (scipy sparse matrix) The matrix of the linear system.
+    Output:
+        Solver object with a solve(b) method.
+    """
+    if isTridiagonal(A):
+        return TridiagonalSolver(A.diagonal(-1), A.diagonal(0),
+                                 A.diagonal(1))
+    return LUSolver(A)
+
+
+def makeSolver(A, backend="auto", **options):
+    """
+    Make the solver of the systems A x = b with the given backend:
+        "auto": the cheapest factorisation, see factorize.
+        "lu": sparse LU factorisation, cached.
+        "direct": sparse direct solve of every system, not cached.
+        "bicgstab", "cgs", "gmres", "lgmres", "qmr": preconditioned Krylov
+            solvers, the options are passed to KrylovSolver.
+    Output:
+        Solver object with a solve(b) method.
+    """
+    if backend == "auto":
+        return factorize(A)
+    if backend == "lu":
+        return LUSolver(A)
+    if backend == "direct":
+        return DirectSolver(A)
+    if backend in KrylovSolver.methods:
+        return KrylovSolver(A, method=backend, **options)
+    raise ValueError("Unknown solver backend: " + str(backend))
+
+
+def preconditionedSolve(A, b, preconditioner, tol=1e-10, maxiter=100):
+    """
+    Solve A x = b with BiCGSTAB, preconditioned with the solver of a nearby
+    matrix, e.g. an older factorisation of A. The preconditioned solution
+    is also the initial guess, so when A has barely changed only a few
+    iterations are needed. A solve that does not converge warns with a
+    ConvergenceWarning.
+    Inputs:
+        A: (scipy sparse matrix) The matrix of the linear system.
+        b: (numpy array) Right hand side, a vector or an (N, K) block.
+        preconditioner: (solver object) Approximate solver of A.
+        tol: (float) Relative tolerance of the residual.
+        maxiter: (int) Maximum number of iterations.
+    Outputs:
+        x: (numpy array) The solution.
+        iterations: (int) Largest number of iterations over the columns.
+    """
+    M = sla.LinearOperator(A.shape, matvec=preconditioner.solve,
+                           dtype=A.dtype)
+    count = [0]
+
+    def callback(xk):
+        count[0] += 1
+
+    columns = b.reshape(len(b), -1)
+    x = np.empty(columns.shape, dtype=np.result_type(A.dtype, b))
+    iterations = 0
+    for k in range(columns.shape[1]):
+        count[0] = 0
+        x[:, k], info = sla.bicgstab(A, columns[:, k],
+                                     x0=preconditioner.solve(columns[:, k]),
+                                     rtol=tol, atol=0, maxiter=maxiter, M=M,
+                                     callback=callback)
+        iterations = max(iterations, count[0])
+        _checkConvergence(info, "bicgstab")
+    return x.reshape(b.shape), iterations
@@ -0,0 +1,157 @@
+"""
+spectral.py
+Evolution of a time independent system in the eigenbasis of its
+Hamiltonian. Once the eigenstates are known,
+    psi(t) = sum_n c_n exp(-i E_n t) phi_n,    c_n = <phi_n|psi(0)>
+gives psi at any time without stepping, in O(k N) for k eigenstates on N
+points. The eigenstates are computed with shift-invert Lanczos (eigsh),
+and can be cached on disk so that they are only computed once per grid
+and potential.
+
+Created on: 18-10-2026.
+"""
+import hashlib
+import os
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as sla
+import storage
+
+
+class Eigenbasis:
+    """
+    The k eigenstates of a Hermitian Hamiltonian closest to the shift sigma,
+    by default the lowest ones, and the projection of a state on them.
+
+    Points decoupled from the rest of the grid (the Dirichlet boundary
+    points of matrix.A*Dfull) are left out of the eigenproblem, there H is
+    diagonal and psi just picks up a phase.
+
+    The truncation to k states is the only error of the evolution: the
+    relative norm of the part of psi outside the basis, self.residual, is
+    computed when projecting. It does not change in time.
+
+    Usage:
+        basis = Eigenbasis(H, 200, cacheDir='eigenstates')
+        basis.project(psi0)
+        psi = basis.psiAt([1, 2, 10])
+    """
+
+    def __init__(self, H, numberEigenstates, sigma=None, cacheDir=None,
+                 tol=0):
+        """
+        Compute (or load from the cache) the eigenstates.
+        Inputs:
+            H: (scipy sparse matrix) Real symmetric or Hermitian
+                Hamiltonian, e.g. from matrix.py.
+            numberEigenstates: (int) Number k of eigenstates.
+            sigma: (float) Energy around which the eigenstates are taken,
+                e.g. the energy of a wave packet. By default just below the
+                potential, which gives the lowest states.
+            cacheDir: (str) Directory of the cache, None to not cache.
+            tol: (float) Relative accuracy of the eigenvalues, 0 for
+                machine precision.
+        """
+        H = sp.csr_matrix(H, copy=True)
+        H.eliminate_zeros()
+        if abs(H - H.conj().T).max() > 1e-12*abs(H).max():
+            raise ValueError("The eigenbasis needs a Hermitian Hamiltonian.")
+        self.size = H.shape[0]
+
+        # Points coupled to others, the rest evolve with their diagonal
+        coupled = np.diff(H.indptr) > 1
+        self.coupled = coupled
+        self.diagonal = H.diagonal()[~coupled]
+        H = H[coupled][:, coupled]
+        if np.all(H.data.imag == 0):
+            H = H.real
+
+        if numberEigenstates >= H.shape[0] - 1:
+            raise ValueError("numberEigenstates must be smaller than the "
+                             "number of points minus 1.")
+        if sigma is None:
+            # Below the spectrum, by the Gershgorin circle theorem
+            diagonal = H.diagonal().real
+            offDiagonal = abs(H).sum(axis=1).A1 - abs(diagonal)
+            sigma = (diagonal - offDiagonal).min() - 1
+        self.sigma = sigma
+
+        filename = None
+        if cacheDir is not None:
+            filename = os.path.join(cacheDir, cacheKey(H, numberEigenstates,
+                                                       sigma, tol) + '.npz')
+        if filename is not None and os.path.exists(filename):
+            with np.load(filename) as cached:
+                self.energies = cached['energies']
+                self.states = cached['states']
+        else:
+            energies, states = sla.eigsh(H, k=numberEigenstates, sigma=sigma,
+                                         which='LM', tol=tol)
+            order = np.argsort(energies)
+            self.energies = energies[order]
+            self.states = states[:, order]
+            if filename is not None:
+                os.makedirs(cacheDir, exist_ok=True)
+                storage.atomicWrite(filename, lambda f: np.savez(
+                    f, energies=self.energies, states=self.states))
+
+        self.coefficients = None
+        self.residual = None
+        self.time = 0
+
+    def project(self, psi, time=0):
+        """
+        Project the state psi at the given time on the eigenbasis.
+        Inputs:
+            psi: (numpy array) A state, or a (K, grid) block of states.
+            time: (float) Time of psi.
+        Output:
+            residual: (float, or array of K) Norm of the part of psi
+                outside the basis, relative to the norm of psi.
+        """
+        psi = np.asarray(psi)
+        self.batch = psi.shape[:-1]
+        # One state per row
+        psi = psi.reshape(-1, self.size)
+        inside = psi[:, self.coupled]
+        c = self.states.T.conj().dot(inside.T)
+        outside = inside - self.states.dot(c).T
+        residual = np.linalg.norm(outside, axis=-1) / \
+            np.linalg.norm(psi, axis=-1)
+        self.residual = residual.reshape(self.batch)
+
+        self.coefficients = c
+        self.edge = psi[:, ~self.coupled]
+        self.time = time
+        return self.residual
+
+    def psiAt(self, time):
+        """
+        Evolved psi at a time, or at an array of T times, with shape
+        batch + (grid,), resp. (T,) + batch + (grid,).
+        """
+        if self.coefficients is None:
+            raise ValueError("Project a state first.")
+        t = np.asarray(time, dtype=float) - self.time
+        times = t.reshape(-1)
+
+        psi = np.zeros((len(times), self.coefficients.shape[1], self.size),
+                       dtype=np.result_type(self.states, np.complex128))
+        for i, dt in enumerate(times):
+            c = np.exp(-1j*self.energies*dt)[:, None]*self.coefficients
+            psi[i][:, self.coupled] = self.states.dot(c).T
+            psi[i][:, ~self.coupled] = np.exp(-1j*self.diagonal*dt) * \
+                self.edge
+        return psi.reshape(t.shape + self.batch + (self.size,))
+
+
+def cacheKey(H, numberEigenstates, sigma, tol):
+    """Hash of the matrix and the options of the eigensolver."""
+    key = hashlib.sha1()
+    H = sp.csr_matrix(H)
+    H.sort_indices()
+    for array in (H.data, H.indices, H.indptr):
+        key.update(np.ascontiguousarray(array).tobytes())
+    key.update(repr((H.shape, str(H.dtype), numberEigenstates, float(sigma),
+                     tol)).encode())
+    return key.hexdigest()
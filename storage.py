@@ -0,0 +1,188 @@
+"""
+storage.py
+Persistence of simulations: an on-disk cache of the assembled operators,
+so that repeated launches with the same system skip building them, and
+periodic checkpoints of the state of a run.
+
+The cache has two levels. Hamiltonian matrices, and the factors of the
+tridiagonal (1D) CN matrices, are saved to a directory, bounded in size
+by removing the least recently used files. The other factorisations
+(SuperLU objects cannot be saved) are kept in memory, for the simulations
+made in the same process, e.g. when a notebook cell is run again.
+
+Created on: 18-10-2026.
+"""
+import collections
+import hashlib
+import os
+import numpy as np
+import scipy.sparse as sp
+import solvers
+
+# Factors of a tridiagonal matrix saved by the cache, as named by gttrf
+GTTRF = ("dl", "d", "du", "du2", "ipiv")
+
+
+def atomicWrite(filename, write):
+    """
+    Write a .npz file with write(temporary) under a temporary name, then
+    rename it to filename, so that an interrupted write never leaves a
+    broken file. The temporary names end in .tmp.npz.
+    """
+    temporary = '%s.%d.tmp.npz' % (filename, os.getpid())
+    try:
+        write(temporary)
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def operatorKey(sim, potential):
+    """
+    Hash of everything the operators of a simulation depend on: the grid,
+    the boundaries, dt, the engine and its options and the sampled
+    potential (with its absorbing layer).
+    """
+    key = hashlib.sha1()
+    options = (sim.dim, sim.numberPoints, sim.domainLength,
+               np.ravel(sim.startPoint).tolist(), sim.sign, sim.dt,
+               sim.engine, sim.order, sim.stencilOrder, sim.solver,
+               sorted(sim.solverOptions.items()), str(sim.dtype))
+    key.update(repr(options).encode())
+    key.update(np.ascontiguousarray(potential).tobytes())
+    if sim.axes is not None:
+        for x in sim.axes:
+            key.update(np.ascontiguousarray(x).tobytes())
+    return key.hexdigest()
+
+
+class OperatorCache:
+    """
+    Cache of the Hamiltonian matrices of simulations on disk, and of their
+    factorisations in memory (and on disk for tridiagonal ones), keyed by
+    operatorKey. Passed to Simulation as cache=OperatorCache(...).
+    """
+
+    def __init__(self, directory, maxBytes=2**30, memoryEntries=4):
+        """
+        Inputs:
+            directory: (str) Directory of the cached matrices.
+            maxBytes: (int) Largest size of the directory, the least
+                recently used matrices are removed beyond it.
+            memoryEntries: (int) Number of factorisations kept in memory.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.maxBytes = maxBytes
+        self.memoryEntries = memoryEntries
+        self._memory = collections.OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _file(self, key, kind=''):
+        return os.path.join(self.directory, key + kind + '.npz')
+
+    def hamiltonian(self, key):
+        """The cached matrix with the key, or None."""
+        filename = self._file(key)
+        try:
+            H = sp.load_npz(filename)
+        except (OSError, ValueError):
+            return None
+        # The access time orders the files for the eviction
+        os.utime(filename)
+        return H.tocsc()
+
+    def storeHamiltonian(self, key, H):
+        """Save a matrix and remove old ones beyond maxBytes."""
+        atomicWrite(self._file(key),
+                    lambda f: sp.save_npz(f, sp.csc_matrix(H),
+                                          compressed=False))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used files beyond maxBytes."""
+        files = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)
+                 if name.endswith('.npz') and not name.endswith('.tmp.npz')]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files[:-1]:
+            if total <= self.maxBytes:
+                break
+            total -= os.path.getsize(f)
+            os.remove(f)
+
+    def solver(self, key):
+        """The factorisation with the key, or None."""
+        if key not in self._memory:
+            filename = self._file(key, '.gttrf')
+            try:
+                with np.load(filename) as data:
+                    factors = [data[name] for name in GTTRF]
+            except (OSError, KeyError, ValueError):
+                return None
+            os.utime(filename)
+            self._remember(key, solvers.TridiagonalSolver.fromFactors(
+                *factors))
+        self._memory.move_to_end(key)
+        return self._memory[key]
+
+    def storeSolver(self, key, solver):
+        """
+        Keep a factorisation, dropping the least recently used ones. The
+        factors of a tridiagonal matrix are also saved.
+        """
+        self._remember(key, solver)
+        if isinstance(solver, solvers.TridiagonalSolver):
+            atomicWrite(self._file(key, '.gttrf'), lambda f: np.savez(
+                f, **dict(zip(GTTRF, solver.factors))))
+            self.evict()
+
+    def _remember(self, key, solver):
+        self._memory[key] = solver
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memoryEntries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Empty both levels of the cache."""
+        self._memory.clear()
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class Checkpointer:
+    """
+    Saves a checkpoint of a simulation every few steps, see
+    Simulation.checkpoint. A run stopped at any time restarts from the last
+    checkpoint with Simulation.restore.
+
+    Usage:
+        sim = Simulation(...)
+        if os.path.exists('run.npz'):
+            sim.restore('run.npz')
+        else:
+            sim.setPsiPulse(...)
+        Checkpointer(sim, 'run.npz', every=1000)
+        while sim.time < end:
+            sim.evolve()
+    """
+
+    def __init__(self, sim, filename, every=1000):
+        self.sim = sim
+        self.filename = filename
+        self.every = every
+        self.steps = 0
+        sim.callbacks.append(self)
+
+    def __call__(self, sim):
+        """Called by the simulation after every step."""
+        self.steps += 1
+        if self.steps % self.every == 0:
+            sim.checkpoint(self.filename)
+
+    def detach(self):
+        """Stop saving checkpoints."""
+        if self in self.sim.callbacks:
+            self.sim.callbacks.remove(self)
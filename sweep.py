@@ -0,0 +1,231 @@
+"""
+sweep.py
+Parameter sweeps over a process pool. Sweeps of the initial pulse over one
+potential share a template Simulation: its operators are built and
+factorised once, in the parent process, and the workers are forked from
+it, so they see the same memory pages (copy-on-write) and nothing but the
+parameters and the results of every run is pickled. Sweeps that change
+the potential build their simulation in every run instead.
+
+Results are saved to disk as the runs finish, one .npz file per set of
+parameters, so an interrupted sweep resumes where it stopped.
+
+Usage:
+    def transmission(sim, energy):
+        sim.setPsiPulse(pulse="plane", energy=energy, center=3)
+        for i in range(500):
+            sim.evolve()
+        return {"T": sim.normPsi()[sim.domain() > 10].sum()}
+
+    sim = Simulation(1, well, True, 2000, 0, 15, 1e-4)
+    for params, result in runSweep(transmission,
+                                   [{"energy": e} for e in energies],
+                                   simulation=sim, output="sweep"):
+        ...
+
+Created on: 18-10-2026.
+"""
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import decomposition
+import storage
+
+# Template simulation and run function of the sweep, set in the parent
+# before forking the workers, which inherit them
+_shared = {}
+
+
+def _toJSON(value):
+    """
+    Numpy numbers and arrays as the python numbers and lists they hold, so
+    that saved parameters load back with the same values.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
+
+
+def resultFile(output, parameters):
+    """File of the result of a set of parameters, named by their hash."""
+    key = json.dumps(parameters, sort_keys=True, default=_toJSON)
+    return os.path.join(output,
+                        hashlib.sha1(key.encode()).hexdigest()[:20] + '.npz')
+
+
+def saveResult(filename, parameters, result):
+    """
+    Save the result of a run, a dict of arrays or numbers (anything else is
+    saved as "result"), with its parameters. The file is written
+    atomically, so an interrupted write leaves no broken result.
+    """
+    if not isinstance(result, dict):
+        result = {"result": result}
+    storage.atomicWrite(filename, lambda f: np.savez(
+        f, parameters=json.dumps(parameters, default=_toJSON), **result))
+
+
+def loadResult(filename):
+    """Parameters and result dict of a saved run."""
+    with np.load(filename) as data:
+        parameters = json.loads(str(data['parameters']))
+        result = {name: data[name] for name in data.files
+                  if name != 'parameters'}
+    return parameters, result
+
+
+def fresh(template):
+    """
+    Copy of a template simulation in its initial state, sharing its
+    operators and factorisations.
+    """
+    sim = copy.copy(template)
+    sim.psi = np.zeros_like(template.psi)
+    sim.pulse = np.zeros_like(template.pulse)
+    sim.time = 0
+    sim.callbacks = []
+    sim.iterationCounts = []
+    # The timers of a profiler are bound to the template
+    if template.profiler is not None:
+        template.profiler.unwrap(sim)
+    return sim
+
+
+def _run(task):
+    """Worker: one run of the sweep."""
+    index, parameters = task
+    start = time.perf_counter()
+    run = _shared["run"]
+    if _shared["simulation"] is None:
+        result = run(**parameters)
+    else:
+        result = run(fresh(_shared["simulation"]), **parameters)
+    return index, result, time.perf_counter() - start
+
+
+def printProgress(done, total, elapsed):
+    """Default progress report, one line on stderr."""
+    remaining = elapsed/done*(total - done) if done else float('nan')
+    sys.stderr.write("\rsweep: %d/%d runs, %.1f s elapsed, %.1f s left  " %
+                     (done, total, elapsed, remaining))
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def runSweep(run, parameters, simulation=None, output=None, workers=None,
+             progress=printProgress):
+    """
+    Run a function for every set of parameters over a pool of forked
+    processes, yielding the results as they finish (in any order).
+    Inputs:
+        run: (function) Called as run(sim, **parameters) with a fresh copy
+            of the simulation, or as run(**parameters) without one. It
+            returns a dict of arrays or numbers.
+        parameters: (list of dict) Keyword arguments of every run, e.g.
+            [{"energy": 100, "width": .5}, ...].
+        simulation: (Simulation) Template shared by the runs, whose
+            operators are factorised before forking. Its potential must be
+            time independent, as the runs share its operators, and its
+            engine cannot be the parallel ADI with several processes.
+        output: (str) Directory where every result is saved as it
+            finishes. Runs whose result is already there are not repeated
+            but loaded, so a sweep resumes after a crash.
+        workers: (int) Number of processes, by default the number of
+            cores. With 1 the runs are made in this process.
+        progress: (function) Called as progress(done, total, elapsed)
+            after every run, None for no report.
+    Output:
+        Generator of (parameters, result) pairs.
+    """
+    if simulation is not None:
+        if simulation.timeDependent:
+            raise ValueError("Sweeps over a time dependent potential must "
+                             "build the simulation in run.")
+        # The forked runs would share the worker processes of the template
+        if workers != 1 and isinstance(simulation._propagator,
+                                       decomposition.ParallelADI):
+            raise ValueError("The runs of a sweep cannot share a parallel "
+                             "ADI template, use workers=1.")
+        simulation.prepare()
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+
+    total = len(parameters)
+    done = 0
+    start = time.perf_counter()
+    tasks = []
+    for index, p in enumerate(parameters):
+        if output is not None and os.path.exists(resultFile(output, p)):
+            done += 1
+            yield loadResult(resultFile(output, p))
+        else:
+            tasks.append((index, p))
+    if progress is not None and done:
+        progress(done, total, time.perf_counter() - start)
+
+    def finished(index, result):
+        if output is not None:
+            saveResult(resultFile(output, parameters[index]),
+                       parameters[index], result)
+        if progress is not None:
+            progress(done, total, time.perf_counter() - start)
+
+    _shared["run"] = run
+    _shared["simulation"] = simulation
+    try:
+        if workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                index, result, duration = _run(task)
+                done += 1
+                finished(index, result)
+                yield parameters[index], result
+            return
+
+        workers = min(workers or os.cpu_count(), len(tasks))
+        context = multiprocessing.get_context("fork")
+        with context.Pool(workers) as pool:
+            for index, result, duration in pool.imap_unordered(_run, tasks):
+                done += 1
+                finished(index, result)
+                yield parameters[index], result
+    finally:
+        _shared.clear()
+
+
+def loadSweep(output):
+    """All the (parameters, result) pairs saved in a sweep directory."""
+    return [loadResult(os.path.join(output, name))
+            for name in sorted(os.listdir(output))
+            if name.endswith('.npz') and not name.endswith('.tmp.npz')]
+
+
+def potentialWell(x):
+    """Barrier 6 < x < 10 of height 500."""
+    return np.where((x > 6) & (x < 10), 500., 0.)
+
+
+def transmission(sim, energy, duration=.25):
+    """Probability beyond the barrier of potentialWell after a time."""
+    sim.setPsiPulse(pulse="plane", energy=energy, center=3, width=.5)
+    for i in range(int(round(duration/sim.dt))):
+        sim.evolve()
+    return {"T": sim.normPsi()[sim.domain() > 10].sum()}
+
+
+if __name__ == "__main__":
+    import simulation as sm
+    sim = sm.Simulation(1, potentialWell, True, 4000, 0, 15, 2e-4,
+                        order=4)
+    energies = np.linspace(100, 1000, 32)
+    results = runSweep(transmission, [{"energy": e} for e in energies],
+                       simulation=sim)
+    for parameters, result in sorted(results, key=lambda r: r[0]["energy"]):
+        print("E = %6.1f  T = %.4f" % (parameters["energy"], result["T"]))
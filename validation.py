@@ -0,0 +1,156 @@
+"""
+validation.py
+Accuracy studies of the time evolution against exact solutions.
+
+Usage:
+    python validation.py
+
+Created on: 18-10-2026.
+"""
+import time
+import numpy as np
+import simulation as sm
+
+
+def freeGaussian(x, t, center, k, width):
+    """
+    Analytic free evolution (hbar = 2m = 1, i psi_t = -psi_xx) of the
+    Gaussian packet exp(i k x) exp(-(x - center)^2/(2 width^2)) made by
+    Simulation.setPsiPulse. It moves at the group velocity 2k and spreads,
+        psi(x, t) = sqrt(s/(s + 2it)) exp(i k x - i k^2 t)
+                    exp(-(x - center - 2kt)^2/(2(s + 2it))),  s = width^2
+    Inputs:
+        x: (numpy array) Positions.
+        t: (float) Time.
+        center, k, width: (float) Parameters of the initial packet.
+    Output:
+        (numpy array) psi(x, t), not normalised.
+    """
+    s = width**2 + 2j*t
+    return np.sqrt(width**2/s)*np.exp(1j*k*x - 1j*k**2*t) * \
+        np.exp(-(x - center - 2*k*t)**2/(2*s))
+
+
+def gaussianError(sim, t, center, k, width):
+    """Largest difference of sim.psi with the analytic Gaussian at t."""
+    exact = freeGaussian(sim.domain(), t, center, k, width)
+    initial = freeGaussian(sim.domain(), 0, center, k, width)
+    return np.abs(sim.psi - exact/np.linalg.norm(initial)).max()
+
+
+def gaussianStudy(orders=(2, 4, 6), dts=(2.5e-4, 5e-4, 1e-3, 2e-3, 5e-3),
+                  energy=500, duration=.05, numberPoints=16384,
+                  domainLength=15, center=4, width=.5):
+    """
+    Evolve a free 1D Gaussian packet with every order and dt, and compare
+    it with the analytic solution. The grid has Dirichlet boundaries,
+    whose points are spaced exactly domainLength/numberPoints as in the
+    stencil, and is fine enough for its discretisation error to be below
+    the errors in time of the study.
+    Output:
+        (list of dict) Order, dt, number of steps, error and run time.
+    """
+    results = []
+    k = np.sqrt(energy)
+    for order in orders:
+        for dt in dts:
+            sim = sm.Simulation(1, lambda x: 0*x, True, numberPoints, 0,
+                                domainLength, dt, order=order)
+            sim.setPsiPulse(pulse="plane", energy=energy, center=center,
+                            width=width)
+            steps = int(round(duration/dt))
+            start = time.perf_counter()
+            for i in range(steps):
+                sim.evolve()
+            results.append({"order": order, "dt": dt, "steps": steps,
+                            "error": gaussianError(sim, sim.time, center, k,
+                                                   width),
+                            "time": time.perf_counter() - start})
+            print("order %d dt %-6g steps %-4d error %.2e  %.3f s" %
+                  tuple(results[-1].values()))
+    return results
+
+
+def stencilStudy(stencilOrders=(2, 4, 6),
+                 points=(250, 500, 1000, 2000, 4000, 8000), energy=500,
+                 duration=.02, dt=1e-4, domainLength=15, center=5,
+                 width=.5, target=1e-3):
+    """
+    Spatial convergence of the finite difference stencils: a free 1D
+    Gaussian packet is evolved with the 6th order Pade propagator and a
+    small dt, so that the error with the analytic solution comes from the
+    grid. The grid has Dirichlet boundaries, whose points are spaced
+    exactly domainLength/numberPoints.
+    Output:
+        (dict) For every stencil order the errors for every number of
+        points, and the number of points needed to reach the target error,
+        interpolated in log-log scale.
+    """
+    k = np.sqrt(energy)
+    results = {}
+    for stencilOrder in stencilOrders:
+        errors = []
+        for numberPoints in points:
+            sim = sm.Simulation(1, lambda x: 0*x, True, numberPoints, 0,
+                                domainLength, dt, order=6,
+                                stencilOrder=stencilOrder)
+            sim.setPsiPulse(pulse="plane", energy=energy, center=center,
+                            width=width)
+            for i in range(int(round(duration/dt))):
+                sim.evolve()
+            errors.append(gaussianError(sim, sim.time, center, k, width))
+            print("stencil %d points %-5d error %.2e" %
+                  (stencilOrder, numberPoints, errors[-1]))
+
+        # First pair of grids around the target
+        needed = None
+        for i in range(len(points) - 1):
+            if errors[i] >= target > errors[i + 1]:
+                slope = np.log(errors[i + 1]/errors[i]) / \
+                    np.log(points[i + 1]/points[i])
+                needed = points[i]*(target/errors[i])**(1/slope)
+                break
+        results[stencilOrder] = {"points": list(points), "errors": errors,
+                                 "needed": needed}
+        print("stencil %d needs %s points for an error of %g" %
+              (stencilOrder, "%.0f" % needed if needed else "?", target))
+    return results
+
+
+def reflectionStudy(widths=(.5, 1, 2, 3), strengths=(50, 200, 800, 3200),
+                    energy=500, numberPoints=3000, domainLength=15,
+                    center=5, width=.5, dt=2e-4):
+    """
+    Measure the reflection coefficient of the absorbing layer. A 1D packet
+    is sent towards the right edge, and R is the probability found in the
+    interior (outside the layers) once a reflected packet would be back at
+    the starting point.
+    Output:
+        (list of dict) Layer width and strength and R. Width 0 is the
+        bare boundary, which reflects everything.
+    """
+    velocity = 2*np.sqrt(energy)
+    steps = int(round(2*(domainLength - center)/velocity/dt))
+    results = []
+    for layer in (0,) + tuple(widths):
+        for strength in strengths if layer else strengths[:1]:
+            sim = sm.Simulation(1, lambda x: 0*x, False, numberPoints, 0,
+                                domainLength, dt, absorberWidth=layer,
+                                absorberStrength=strength)
+            sim.setPsiPulse(pulse="plane", energy=energy, center=center,
+                            width=width)
+            for i in range(steps):
+                sim.evolve()
+            x = sim.domain()
+            interior = (x > layer) & (x < domainLength - layer)
+            results.append({"width": layer, "strength": strength,
+                            "R": np.sum(sim.normPsi()[interior])})
+            print("layer %-4g strength %-5g R %.2e" %
+                  tuple(results[-1].values()))
+    return results
+
+
+if __name__ == "__main__":
+    gaussianStudy()
+    reflectionStudy()
+    stencilStudy()